@@ -0,0 +1,186 @@
+"""
+Benchmark: deduplication strategies of the consolidation job
+============================================================
+
+Runs the strategies in dedup.py on synthetic chargeback data with local
+PySpark, next to the plan the job used before them:
+
+    legacy      row_number() window over chargeback_id, then
+                repartition(OUTPUT_FILE_COUNT, chargeback_id): two shuffles
+    window      dedup.latest_per_key(strategy="window"): one shuffle
+    max_struct  dedup.latest_per_key(strategy="max_struct"): one shuffle
+
+Each duplicate rate gives a dataset of --rows rows in which that fraction
+are older versions of another row's chargeback. Every strategy is timed
+writing to the noop sink, so only the dedup and the shuffle are measured.
+Its physical plan is summarized as the number of exchanges and sorts and
+the aggregate operator used (HashAggregate, ObjectHashAggregate or
+SortAggregate), so a plan that sorts where a hash aggregation was expected
+shows up next to the timings; --explain prints the full plans. The results
+are checked against each other once per duplicate rate.
+
+Needs pyspark (pip install "pyspark==3.1.*" matches Glue 3.0) and a JVM.
+
+Usage:
+    python bench_dedup.py [--rows 2000000] [--duplicate-rates 0,0.1,0.5,0.9]
+                          [--partitions 10] [--repeat 3] [--master local[*]]
+                          [--explain]
+
+Author: POC Chargeback Team
+"""
+
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+from collections import Counter
+
+from pyspark.sql import SparkSession, Window
+from pyspark.sql import functions as F
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dedup import STRATEGIES, latest_per_key
+
+ORDER_BY = ["updated_at", "execution_sequence"]
+
+STATUSES = ["pending", "under_review", "accepted", "rejected", "won", "lost"]
+
+AGGREGATES = ("HashAggregate", "ObjectHashAggregate", "SortAggregate")
+
+# Operator name at the start of a physical plan line, after the tree drawing
+# and the optional whole-stage codegen marker, e.g. "+- *(2) Sort [...]"
+PLAN_NODE = re.compile(r"^[\s:+\-|]*(?:\*\(\d+\)\s*)?([A-Za-z]+)")
+
+
+def synthetic_chargebacks(spark, rows, duplicate_rate, partitions):
+    """
+    Landing-like chargebacks where duplicate_rate of the rows repeat a key.
+
+    Row i belongs to chargeback i % distinct, so every chargeback has one or
+    more versions; updated_at increases with i, so the latest one is unique.
+    """
+    distinct = max(1, int(rows * (1 - duplicate_rate)))
+    key = F.col("id") % distinct
+    status = F.array(*[F.lit(status) for status in STATUSES])[(F.col("id") % len(STATUSES)).cast("int")]
+
+    return spark.range(0, rows, numPartitions=partitions * 4).select(
+        F.format_string("cb_%010d", key).alias("chargeback_id"),
+        F.format_string("merch_%d", key % 5000).alias("merchant_id"),
+        F.format_string("txn_%012d", key).alias("transaction_id"),
+        (key % 100000 / 100).alias("amount"),
+        F.lit("BRL").alias("currency"),
+        status.alias("status"),
+        F.lit("Product not received").alias("reason"),
+        F.struct(
+            F.format_string("txn_%012d", key).alias("transaction_id"),
+            F.format_string("customer_%d@example.com", key).alias("customer_email"),
+        ).alias("metadata"),
+        F.lit("2025-11-20 10:00:00").cast("timestamp").alias("created_at"),
+        (F.lit(1763632800) + F.col("id")).cast("timestamp").alias("updated_at"),
+        (F.col("id") % 4 + 1).cast("int").alias("execution_sequence"),
+    )
+
+
+def legacy(df, partitions):
+    window = Window.partitionBy("chargeback_id").orderBy(*[F.col(column).desc() for column in ORDER_BY])
+    return df.withColumn("row_num", F.row_number().over(window)) \
+        .filter(F.col("row_num") == 1) \
+        .drop("row_num") \
+        .repartition(partitions, "chargeback_id")
+
+
+def plans(partitions):
+    """Dedup plan per name, legacy first (the baseline)."""
+    result = {"legacy": lambda df: legacy(df, partitions)}
+    for strategy in STRATEGIES:
+        result[strategy] = lambda df, strategy=strategy: latest_per_key(df, "chargeback_id", ORDER_BY, partitions, strategy)
+    return result
+
+
+def physical_plan(df):
+    return df._jdf.queryExecution().executedPlan().toString()
+
+
+def plan_nodes(df):
+    """Operator counts of the physical plan, e.g. {"Exchange": 1, "Sort": 1}."""
+    nodes = Counter()
+    for line in physical_plan(df).splitlines():
+        match = PLAN_NODE.match(line)
+        if match:
+            nodes[match.group(1)] += 1
+    return nodes
+
+
+def aggregate_kind(nodes):
+    kinds = [kind for kind in AGGREGATES if nodes[kind]]
+    return "+".join(kinds) if kinds else "-"
+
+
+def time_write(df, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        df.write.format("noop").mode("overwrite").save()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, default=2000000, help="Rows per dataset")
+    parser.add_argument("--duplicate-rates", default="0,0.1,0.5,0.9",
+                        help="Comma-separated fractions of rows that are older versions")
+    parser.add_argument("--partitions", type=int, default=10, help="Output partitions (OUTPUT_FILE_COUNT)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per strategy (median reported)")
+    parser.add_argument("--master", default="local[*]", help="Spark master")
+    parser.add_argument("--no-check", action="store_true", help="Skip comparing the strategies' results")
+    parser.add_argument("--explain", action="store_true", help="Print each strategy's physical plan")
+    args = parser.parse_args()
+
+    spark = SparkSession.builder \
+        .master(args.master) \
+        .appName("bench-dedup") \
+        .config("spark.ui.enabled", "false") \
+        .config("spark.sql.adaptive.enabled", "false") \
+        .getOrCreate()
+    spark.sparkContext.setLogLevel("WARN")
+
+    strategies = plans(args.partitions)
+
+    print(f"\n{'dup rate':>8} {'strategy':<11} {'exchanges':>9} {'sorts':>5} {'aggregate':<20} "
+          f"{'seconds':>9} {'rows/s':>12} {'vs legacy':>9}")
+    for duplicate_rate in [float(rate) for rate in args.duplicate_rates.split(",")]:
+        source = synthetic_chargebacks(spark, args.rows, duplicate_rate, args.partitions).cache()
+        source.count()
+
+        results = {}
+        for name, plan in strategies.items():
+            deduped = plan(source)
+            results[name] = deduped
+            seconds = time_write(deduped, args.repeat)
+            if name == "legacy":
+                baseline = seconds
+            nodes = plan_nodes(deduped)
+            print(f"{duplicate_rate:8.2f} {name:<11} {nodes['Exchange']:9d} {nodes['Sort']:5d} "
+                  f"{aggregate_kind(nodes):<20} {seconds:9.2f} {args.rows / seconds:12,.0f} "
+                  f"{baseline / seconds:8.2f}x")
+            if args.explain:
+                print(physical_plan(deduped))
+
+        if not args.no_check:
+            expected = results["legacy"]
+            for name, deduped in results.items():
+                if name != "legacy" and (expected.exceptAll(deduped).count() or deduped.exceptAll(expected).count()):
+                    print(f"MISMATCH: {name} differs from legacy at duplicate rate {duplicate_rate}")
+                    sys.exit(1)
+
+        source.unpersist()
+
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -39,7 +39,10 @@ Version: 2.0.0
 Glue Version: 3.0 (Spark 3.1, Python 3.7)
 """
 
+import json
+import re
 import sys
+import time
 from datetime import datetime, timedelta
 from awsglue.transforms import *
 from awsglue.utils import getResolvedOptions
@@ -47,9 +50,12 @@ from pyspark.context import SparkContext
 from awsglue.context import GlueContext
 from awsglue.job import Job
 from pyspark.sql import functions as F
-from pyspark.sql import Window
+from pyspark import StorageLevel
 from pyspark.sql.types import *
 
+# Shipped next to the script with --extra-py-files
+from dedup import STRATEGIES as DEDUP_STRATEGIES, latest_per_key
+
 # =============================================================================
 # CONFIGURATION AND ARGUMENTS
 # =============================================================================
@@ -78,7 +84,12 @@ optional_args = {
     'CSV_QUOTE_CHAR': '"',
     'ENABLE_KAFKA': 'false',
     'KAFKA_BOOTSTRAP_SERVERS': '',
-    'KAFKA_TOPIC': 'chargeback-consolidation-events'
+    'KAFKA_TOPIC': 'chargeback-consolidation-events',
+    'PERSIST_STAGES': 'true',
+    'PERSIST_STORAGE_LEVEL': 'MEMORY_AND_DISK',
+    'VERIFY_MODE': 'metrics',
+    'CONSOLIDATION_MODE': 'full',
+    'DEDUP_STRATEGY': 'max_struct'
 }
 
 for key, default in optional_args.items():
@@ -106,6 +117,41 @@ ENABLE_KAFKA = args['ENABLE_KAFKA'].lower() == 'true'
 KAFKA_BOOTSTRAP_SERVERS = args['KAFKA_BOOTSTRAP_SERVERS']
 KAFKA_TOPIC = args['KAFKA_TOPIC']
 
+# Stage materialization: persist the source data (read by profiling and
+# dedup) and the deduplicated data (read by its count and the write) instead
+# of recomputing them from the catalog for every action
+PERSIST_STAGES = args['PERSIST_STAGES'].lower() == 'true'
+PERSIST_STORAGE_LEVEL = args['PERSIST_STORAGE_LEVEL'].upper()
+if not isinstance(getattr(StorageLevel, PERSIST_STORAGE_LEVEL, None), StorageLevel):
+    raise ValueError(f"Unsupported PERSIST_STORAGE_LEVEL: {PERSIST_STORAGE_LEVEL}")
+
+# Output verification:
+#   metrics  row counts per output file from the data being written, file
+#            sizes from a listing of the committed output, saved as
+#            _manifest.json next to the files (no re-read)
+#   deep     metrics plus reading the whole output back and counting it
+#   none     no verification and no manifest
+VERIFY_MODE = args['VERIFY_MODE'].lower()
+if VERIFY_MODE not in ('metrics', 'deep', 'none'):
+    raise ValueError(f"Unsupported VERIFY_MODE: {VERIFY_MODE}")
+
+# Consolidation mode:
+#   full         read the whole landing partition and overwrite the output
+#   incremental  read only landing files added since the last committed run
+#                (Glue job bookmarks on the "datasource" transformation_ctx;
+#                the job needs --job-bookmark-option job-bookmark-enable) and
+#                merge them into the day's existing consolidated output
+CONSOLIDATION_MODE = args['CONSOLIDATION_MODE'].lower()
+if CONSOLIDATION_MODE not in ('full', 'incremental'):
+    raise ValueError(f"Unsupported CONSOLIDATION_MODE: {CONSOLIDATION_MODE}")
+INCREMENTAL = CONSOLIDATION_MODE == 'incremental'
+
+# Deduplication: max_struct (max of a struct per key) or window (row_number);
+# both share one shuffle with the output partitioning, see dedup.py
+DEDUP_STRATEGY = args['DEDUP_STRATEGY'].lower()
+if DEDUP_STRATEGY not in DEDUP_STRATEGIES:
+    raise ValueError(f"Unsupported DEDUP_STRATEGY: {DEDUP_STRATEGY}")
+
 # Calculate partition date (yesterday's data, or specified)
 if args['PARTITION_DATE']:
     partition_date = datetime.strptime(args['PARTITION_DATE'], '%Y-%m-%d')
@@ -117,6 +163,17 @@ PARTITION_YEAR = partition_date.strftime('%Y')
 PARTITION_MONTH = partition_date.strftime('%m')
 PARTITION_DAY = partition_date.strftime('%d')
 
+# Output path with date partitioning
+output_path_with_partition = f"{OUTPUT_PATH}/year={PARTITION_YEAR}/month={PARTITION_MONTH}/day={PARTITION_DAY}"
+
+# Incremental merges are written here first and then moved into place: the
+# job reads the existing output while writing, so it cannot overwrite it
+# directly. Spark and Athena skip paths starting with "_".
+staging_output_path = (
+    f"{OUTPUT_PATH}/_staging/year={PARTITION_YEAR}/month={PARTITION_MONTH}/day={PARTITION_DAY}"
+    f"/execution={EXECUTION_SEQUENCE}"
+)
+
 # =============================================================================
 # INITIALIZE SPARK AND GLUE CONTEXTS
 # =============================================================================
@@ -148,13 +205,171 @@ print(f"Compression Codec: {COMPRESSION_CODEC}")
 print(f"Partition: year={PARTITION_YEAR}/month={PARTITION_MONTH}/day={PARTITION_DAY}")
 print(f"Partition Filter Enabled: {ENABLE_PARTITION_FILTER}")
 print(f"Dry Run: {DRY_RUN}")
+print(f"Persist Stages: {PERSIST_STAGES} ({PERSIST_STORAGE_LEVEL})")
+print(f"Verify Mode: {VERIFY_MODE}")
+print(f"Consolidation Mode: {CONSOLIDATION_MODE}")
+print(f"Dedup Strategy: {DEDUP_STRATEGY}")
 print("=" * 80)
 
+# Wall-clock seconds per stage, logged in the summary
+STAGE_TIMINGS = {}
+
+
+def end_stage(name, started):
+    """Record the time since `started` (time.perf_counter()) for a stage."""
+    STAGE_TIMINGS[name] = time.perf_counter() - started
+    print(f"  Stage time ({name}): {STAGE_TIMINGS[name]:.1f}s")
+
+
+def materialize(frame, name):
+    """Persist a DataFrame at PERSIST_STORAGE_LEVEL when PERSIST_STAGES is on."""
+    if not PERSIST_STAGES:
+        return frame
+    print(f"  Persisting {name} ({PERSIST_STORAGE_LEVEL})")
+    return frame.persist(getattr(StorageLevel, PERSIST_STORAGE_LEVEL))
+
+
+def release(frame, name):
+    """Unpersist a DataFrame persisted by materialize."""
+    if PERSIST_STAGES:
+        frame.unpersist()
+        print(f"  Released {name}")
+
+
+# Spark names output files part-<task partition>-<job uuid>-c<file>.<ext>
+PART_FILE_PATTERN = re.compile(r"^part-(\d+)-")
+
+
+def _hadoop_path(path):
+    hadoop_path = sc._jvm.org.apache.hadoop.fs.Path(path)
+    return hadoop_path, hadoop_path.getFileSystem(sc._jsc.hadoopConfiguration())
+
+
+def list_output_files(path):
+    """Names and sizes of the committed part files under `path` (a listing, no read)."""
+    hadoop_path, fs = _hadoop_path(path)
+    if not fs.exists(hadoop_path):
+        return []
+    files = []
+    for status in fs.listStatus(hadoop_path):
+        name = status.getPath().getName()
+        if status.isFile() and name.startswith("part-"):
+            files.append((name, status.getLen()))
+    return sorted(files)
+
+
+def write_text_file(path, text):
+    """Write (overwrite) a small UTF-8 file through the Hadoop FileSystem API."""
+    hadoop_path, fs = _hadoop_path(path)
+    stream = fs.create(hadoop_path, True)
+    try:
+        stream.write(bytearray(text.encode("utf-8")))
+    finally:
+        stream.close()
+
+
+def read_text_file(path):
+    """Read a small UTF-8 file, or None if it does not exist."""
+    hadoop_path, fs = _hadoop_path(path)
+    if not fs.exists(hadoop_path):
+        return None
+    return "\n".join(row.value for row in spark.read.text(path).collect())
+
+
+def read_consolidated_output(path, schema=None):
+    """Read consolidated output written by this job, with the writer's options."""
+    reader = spark.read
+    if schema is not None:
+        reader = reader.schema(schema)
+    if OUTPUT_FORMAT == "csv":
+        return reader \
+            .option("header", str(CSV_HEADER).lower()) \
+            .option("delimiter", CSV_DELIMITER) \
+            .option("quote", CSV_QUOTE_CHAR) \
+            .option("escape", "\\") \
+            .csv(path)
+    if OUTPUT_FORMAT == "parquet":
+        return reader.parquet(path)
+    return reader.json(path)
+
+
+def swap_in_staged_output(staging_path, live_path):
+    """
+    Replace the part files in live_path with the ones in staging_path.
+    
+    New files are moved in before the old ones are deleted, so a concurrent
+    reader may briefly see both versions but never a missing day.
+    """
+    staging, fs = _hadoop_path(staging_path)
+    live, _ = _hadoop_path(live_path)
+    jvm_path = sc._jvm.org.apache.hadoop.fs.Path
+    
+    old_files = [name for name, _ in list_output_files(live_path)]
+    for name, _ in list_output_files(staging_path):
+        if not fs.rename(jvm_path(staging, name), jvm_path(live, name)):
+            raise IOError(f"Failed to move {staging_path}/{name} to {live_path}")
+    for name in old_files:
+        fs.delete(jvm_path(live, name), False)
+    fs.delete(staging, True)
+    
+    print(f"✓ Replaced {len(old_files)} files in {live_path} with the merged output")
+
+
+def build_manifest(output_path, row_counts):
+    """
+    Describe the committed output: every part file with its size and rows.
+    
+    Output file N is written by task N, so its rows are the row count of
+    partition N of the written DataFrame (row_counts). Partitions that wrote
+    more than one file only report rows for the partition as a whole.
+    
+    Returns:
+        Manifest dict
+    """
+    files = list_output_files(output_path)
+    files_per_partition = {}
+    for name, _ in files:
+        match = PART_FILE_PATTERN.match(name)
+        if match:
+            partition_id = int(match.group(1))
+            files_per_partition[partition_id] = files_per_partition.get(partition_id, 0) + 1
+    
+    entries = []
+    for name, size in files:
+        match = PART_FILE_PATTERN.match(name)
+        partition_id = int(match.group(1)) if match else None
+        entry = {"name": name, "bytes": size, "partition": partition_id}
+        if partition_id is not None and files_per_partition[partition_id] == 1:
+            entry["rows"] = row_counts.get(partition_id, 0)
+        entries.append(entry)
+    
+    # Partitions with rows but no file point at an incomplete write
+    missing = sorted(
+        partition_id for partition_id, rows in row_counts.items()
+        if rows > 0 and partition_id not in files_per_partition
+    )
+    
+    return {
+        "partition_date": f"{PARTITION_YEAR}-{PARTITION_MONTH}-{PARTITION_DAY}",
+        "execution_sequence": EXECUTION_SEQUENCE,
+        "execution_time": EXECUTION_TIME,
+        "job_name": args['JOB_NAME'],
+        "format": OUTPUT_FORMAT,
+        "file_count": len(entries),
+        "total_bytes": sum(entry["bytes"] for entry in entries),
+        "total_rows": sum(row_counts.get(partition_id, 0) for partition_id in files_per_partition),
+        "missing_partitions": missing,
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "files": entries,
+    }
+
+
 # =============================================================================
 # READ DATA FROM GLUE CATALOG
 # =============================================================================
 
 print(f"\n[1/7] Reading data from Glue Catalog...")
+stage_started = time.perf_counter()
 print(f"Output Format: {OUTPUT_FORMAT.upper()}")
 
 try:
@@ -179,19 +394,11 @@ try:
             transformation_ctx="datasource"
         )
     
-    # Convert to Spark DataFrame for better control
-    df = datasource.toDF()
-    
-    # Check if data exists
-    record_count = df.count()
+    # Convert to Spark DataFrame for better control; persisted so profiling
+    # and deduplication share a single read of the landing data
+    df = materialize(datasource.toDF(), "landing data")
     
-    if record_count == 0:
-        print(f"WARNING: No data found for partition year={PARTITION_YEAR}/month={PARTITION_MONTH}/day={PARTITION_DAY}")
-        print("Job will complete successfully but no output will be written.")
-        job.commit()
-        sys.exit(0)
-    
-    print(f"✓ Successfully read {record_count:,} records from landing zone")
+    print(f"✓ Loaded landing zone table")
     print(f"  Schema: {len(df.columns)} columns")
     print(f"  Partitions: {df.rdd.getNumPartitions()}")
     
@@ -199,33 +406,82 @@ except Exception as e:
     print(f"ERROR: Failed to read from Glue Catalog: {str(e)}")
     raise
 
+end_stage("read", stage_started)
+
 # =============================================================================
 # DATA QUALITY CHECKS
 # =============================================================================
 
 print("\n[2/7] Performing data quality checks...")
 
-# Check for null chargeback_ids
-null_ids = df.filter(F.col("chargeback_id").isNull()).count()
-if null_ids > 0:
-    print(f"WARNING: Found {null_ids} records with null chargeback_id")
+# Record-level checks: name -> condition a record fails. Every check is summed
+# in the profiling aggregation below, so adding one costs no extra scan.
+QUALITY_CHECKS = {
+    "null_chargeback_ids": F.col("chargeback_id").isNull(),
+    "null_updated_at": F.col("updated_at").isNull(),
+}
 
-# Check for duplicates
-duplicate_count = df.groupBy("chargeback_id").count().filter(F.col("count") > 1).count()
-if duplicate_count > 0:
-    print(f"WARNING: Found {duplicate_count} duplicate chargeback_ids")
+# Columns whose value distribution is reported
+PROFILE_DIMENSIONS = ["event_type", "status"]
 
-# Log event type distribution
-print("\nEvent Type Distribution:")
-event_distribution = df.groupBy("event_type").count().collect()
-for row in event_distribution:
-    print(f"  {row['event_type']}: {row['count']:,} records")
 
-# Log status distribution
-print("\nStatus Distribution:")
-status_distribution = df.groupBy("status").count().collect()
-for row in status_distribution:
-    print(f"  {row['status']}: {row['count']:,} records")
+def profile_landing_data(source_df):
+    """
+    Profile the landing data in a single aggregation.
+    
+    Counts records and failed QUALITY_CHECKS per combination of
+    PROFILE_DIMENSIONS (a handful of rows), then derives the totals and the
+    per-column distributions on the driver.
+    
+    Returns:
+        Quality report dict: total_records, checks, distributions
+    """
+    aggregations = [F.count(F.lit(1)).alias("records")] + [
+        F.sum(F.when(condition, 1).otherwise(0)).alias(name)
+        for name, condition in QUALITY_CHECKS.items()
+    ]
+    rows = source_df.groupBy(*PROFILE_DIMENSIONS).agg(*aggregations).collect()
+    
+    report = {
+        "partition_date": f"{PARTITION_YEAR}-{PARTITION_MONTH}-{PARTITION_DAY}",
+        "total_records": 0,
+        "checks": {name: 0 for name in QUALITY_CHECKS},
+        "distributions": {dimension: {} for dimension in PROFILE_DIMENSIONS},
+    }
+    
+    for row in rows:
+        report["total_records"] += row["records"]
+        for name in QUALITY_CHECKS:
+            report["checks"][name] += row[name] or 0
+        for dimension in PROFILE_DIMENSIONS:
+            value = str(row[dimension]) if row[dimension] is not None else "null"
+            distribution = report["distributions"][dimension]
+            distribution[value] = distribution.get(value, 0) + row["records"]
+    
+    return report
+
+
+stage_started = time.perf_counter()
+quality_report = profile_landing_data(df)
+record_count = quality_report["total_records"]
+end_stage("profile", stage_started)
+
+if record_count == 0:
+    print(f"WARNING: No data found for partition year={PARTITION_YEAR}/month={PARTITION_MONTH}/day={PARTITION_DAY}")
+    print("Job will complete successfully but no output will be written.")
+    job.commit()
+    sys.exit(0)
+
+print(f"✓ Successfully read {record_count:,} records from landing zone")
+
+for name, failed in quality_report["checks"].items():
+    if failed > 0:
+        print(f"WARNING: {failed:,} records failed check {name}")
+
+for dimension, distribution in quality_report["distributions"].items():
+    print(f"\n{dimension} distribution:")
+    for value, count in sorted(distribution.items(), key=lambda item: -item[1]):
+        print(f"  {value}: {count:,} records")
 
 print("✓ Data quality checks completed")
 
@@ -234,6 +490,7 @@ print("✓ Data quality checks completed")
 # =============================================================================
 
 print("\n[3/7] Adding metadata and deduplication...")
+stage_started = time.perf_counter()
 
 # Add processing metadata
 df_transformed = df.withColumn(
@@ -247,29 +504,73 @@ df_transformed = df.withColumn(
     F.lit(EXECUTION_SEQUENCE)
 )
 
-# Deduplicate by chargeback_id (keep latest by updated_at)
-print("Deduplicating records...")
-df_deduped = df_transformed.withColumn(
-    "row_num",
-    F.row_number().over(
-        Window.partitionBy("chargeback_id").orderBy(F.col("updated_at").desc())
-    )
-).filter(F.col("row_num") == 1).drop("row_num")
-
-deduped_count = df_deduped.count()
-removed_duplicates = record_count - deduped_count
+# Incremental mode: the new landing records are merged with the day's
+# existing consolidated output (a few large files), so earlier executions'
+# landing files are not read again
+previous_rows = 0
+merge_existing_output = False
+if INCREMENTAL and list_output_files(output_path_with_partition):
+    merge_existing_output = True
+    df_existing = read_consolidated_output(output_path_with_partition, schema=df_transformed.schema)
+    
+    # Row count of the existing output: from its manifest when there is one
+    previous_manifest = read_text_file(f"{output_path_with_partition}/_manifest.json")
+    if previous_manifest is not None:
+        previous_rows = json.loads(previous_manifest)["total_rows"]
+    else:
+        previous_rows = df_existing.count()
+    
+    print(f"Merging {record_count:,} new records into {previous_rows:,} previously consolidated records")
+    df_transformed = df_transformed.unionByName(df_existing)
+elif INCREMENTAL:
+    print("No consolidated output for this day yet; writing the new records directly")
+
+# Deduplicate by chargeback_id (keep latest by updated_at; on a tie, the
+# record from the latest execution)
+print(f"Deduplicating records ({DEDUP_STRATEGY})...")
+
+# The result is hash-partitioned by chargeback_id into OUTPUT_FILE_COUNT
+# partitions by the same shuffle that deduplicates it. It is persisted so the
+# write reuses it instead of recomputing it. The persisted partitions are
+# exactly the output files, so counting rows per partition gives the per-file
+# row counts for verification. The count materializes it, after which the
+# landing data is no longer needed
+df_deduped = materialize(
+    latest_per_key(
+        df_transformed,
+        key="chargeback_id",
+        order_by=["updated_at", "execution_sequence"],
+        num_partitions=OUTPUT_FILE_COUNT,
+        strategy=DEDUP_STRATEGY,
+    ),
+    "deduplicated data",
+)
+partition_row_counts = {
+    row["partition_id"]: row["count"]
+    for row in df_deduped.groupBy(F.spark_partition_id().alias("partition_id")).count().collect()
+}
+deduped_count = sum(partition_row_counts.values())
+removed_duplicates = record_count + previous_rows - deduped_count
+release(df, "landing data")
+end_stage("dedup", stage_started)
 
 print(f"✓ Removed {removed_duplicates:,} duplicate records")
 print(f"✓ Final record count: {deduped_count:,}")
 
+# Duplicates come from the dedup step rather than a separate groupBy scan
+quality_report["duplicate_rows"] = removed_duplicates
+
+# Structured report for CloudWatch Logs Insights
+print(f"QUALITY_REPORT: {json.dumps(quality_report, sort_keys=True)}")
+
 # =============================================================================
 # REPARTITION FOR OPTIMAL FILE SIZE
 # =============================================================================
 
 print(f"\n[4/7] Repartitioning data to {OUTPUT_FILE_COUNT} files...")
 
-# Repartition by hash of chargeback_id for even distribution
-df_repartitioned = df_deduped.repartition(OUTPUT_FILE_COUNT, "chargeback_id")
+# Already hash-partitioned by chargeback_id in the dedup stage
+df_repartitioned = df_deduped
 
 print(f"✓ Repartitioned to {df_repartitioned.rdd.getNumPartitions()} partitions")
 
@@ -278,16 +579,20 @@ print(f"✓ Repartitioned to {df_repartitioned.rdd.getNumPartitions()} partition
 # =============================================================================
 
 print(f"\n[5/7] Writing consolidated {OUTPUT_FORMAT.upper()} files...")
+stage_started = time.perf_counter()
+output_manifest = None
 
 if DRY_RUN:
     print("DRY RUN MODE: Skipping write operation")
     print(f"Would write to: {OUTPUT_PATH}")
 else:
     try:
-        # Output path with date partitioning
-        output_path_with_partition = f"{OUTPUT_PATH}/year={PARTITION_YEAR}/month={PARTITION_MONTH}/day={PARTITION_DAY}"
+        # A merge reads the live output, so it is written to staging first
+        write_path = staging_output_path if merge_existing_output else output_path_with_partition
         
         print(f"Output path: {output_path_with_partition}")
+        if merge_existing_output:
+            print(f"Staging path: {write_path}")
         print(f"Format: {OUTPUT_FORMAT}")
         print(f"Expected files: {OUTPUT_FILE_COUNT}")
         
@@ -304,14 +609,10 @@ else:
                 .option("quote", CSV_QUOTE_CHAR) \
                 .option("escape", "\\") \
                 .option("quoteMode", "MINIMAL") \
-                .save(output_path_with_partition)
+                .save(write_path)
             
             print("✓ Successfully wrote consolidated CSV files")
             
-            # Verify output
-            output_files = spark.read.csv(output_path_with_partition, header=CSV_HEADER)
-            output_count = output_files.count()
-            
         elif OUTPUT_FORMAT == "parquet":
             print(f"Compression: {COMPRESSION_CODEC}")
             
@@ -321,43 +622,58 @@ else:
                 .option("compression", COMPRESSION_CODEC) \
                 .option("parquet.block.size", 134217728) \
                 .option("parquet.page.size", 1048576) \
-                .save(output_path_with_partition)
+                .save(write_path)
             
             print("✓ Successfully wrote consolidated Parquet files")
             
-            # Verify output
-            output_files = spark.read.parquet(output_path_with_partition)
-            output_count = output_files.count()
-            
         elif OUTPUT_FORMAT == "json":
             df_repartitioned.write \
                 .mode("overwrite") \
                 .format("json") \
-                .save(output_path_with_partition)
+                .save(write_path)
             
             print("✓ Successfully wrote consolidated JSON files")
             
-            # Verify output
-            output_files = spark.read.json(output_path_with_partition)
-            output_count = output_files.count()
-            
         else:
             raise ValueError(f"Unsupported output format: {OUTPUT_FORMAT}")
         
-        print(f"✓ Verification: Output contains {output_count:,} records")
+        if merge_existing_output:
+            swap_in_staged_output(write_path, output_path_with_partition)
         
-        if output_count != deduped_count:
-            print(f"WARNING: Output record count ({output_count}) does not match input ({deduped_count})")
+        # Verify output from the write's own numbers and record them
+        if VERIFY_MODE != "none":
+            output_manifest = build_manifest(output_path_with_partition, partition_row_counts)
+            write_text_file(f"{output_path_with_partition}/_manifest.json", json.dumps(output_manifest, indent=2))
+            output_count = output_manifest["total_rows"]
+            
+            print(f"✓ Manifest: {output_manifest['file_count']} files, {output_manifest['total_bytes']:,} bytes, {output_count:,} records")
+            if output_manifest["missing_partitions"]:
+                print(f"WARNING: No output file for partitions {output_manifest['missing_partitions']}")
+            if output_count != deduped_count:
+                print(f"WARNING: Output record count ({output_count}) does not match input ({deduped_count})")
+        
+        # Deep check: read everything back (doubles the I/O, re-parses CSV/JSON)
+        if VERIFY_MODE == "deep":
+            reread_count = read_consolidated_output(output_path_with_partition).count()
+            
+            print(f"✓ Deep verification: Output contains {reread_count:,} records")
+            
+            if reread_count != deduped_count:
+                print(f"WARNING: Re-read record count ({reread_count}) does not match input ({deduped_count})")
         
     except Exception as e:
         print(f"ERROR: Failed to write output: {str(e)}")
         raise
 
+release(df_deduped, "deduplicated data")
+end_stage("write", stage_started)
+
 # =============================================================================
 # SEND KAFKA NOTIFICATION (if enabled)
 # =============================================================================
 
 print("\n[6/7] Sending consolidation event to Kafka...")
+stage_started = time.perf_counter()
 
 if ENABLE_KAFKA and KAFKA_BOOTSTRAP_SERVERS:
     try:
@@ -436,6 +752,8 @@ else:
     else:
         print("WARNING: Kafka enabled but bootstrap servers not configured")
 
+end_stage("kafka", stage_started)
+
 # =============================================================================
 # LOG METRICS AND SUMMARY
 # =============================================================================
@@ -447,10 +765,16 @@ execution_end_time = datetime.utcnow()
 execution_start_time = datetime.fromisoformat(EXECUTION_TIME.replace('Z', ''))
 execution_duration_seconds = (execution_end_time - execution_start_time).total_seconds()
 
-# Estimate file sizes (approximate)
-avg_record_size_bytes = 100  # Estimated compressed size per record
-total_size_mb = (deduped_count * avg_record_size_bytes) / 1024 / 1024
-avg_file_size_mb = total_size_mb / OUTPUT_FILE_COUNT
+# File sizes: actual from the manifest, otherwise estimated
+if output_manifest is not None:
+    total_size_mb = output_manifest["total_bytes"] / 1024 / 1024
+    avg_file_size_mb = total_size_mb / max(output_manifest["file_count"], 1)
+    size_label = "Actual"
+else:
+    avg_record_size_bytes = 100  # Estimated compressed size per record
+    total_size_mb = (deduped_count * avg_record_size_bytes) / 1024 / 1024
+    avg_file_size_mb = total_size_mb / OUTPUT_FILE_COUNT
+    size_label = "Estimated"
 
 print("\n" + "=" * 80)
 print("CONSOLIDATION SUMMARY")
@@ -461,8 +785,8 @@ print(f"Duplicates Removed: {removed_duplicates:,}")
 print(f"Output Records: {deduped_count:,}")
 print(f"Output Format: {OUTPUT_FORMAT.upper()}")
 print(f"Output Files: {OUTPUT_FILE_COUNT}")
-print(f"Estimated Total Size: {total_size_mb:.2f} MB")
-print(f"Estimated Avg File Size: {avg_file_size_mb:.2f} MB")
+print(f"{size_label} Total Size: {total_size_mb:.2f} MB")
+print(f"{size_label} Avg File Size: {avg_file_size_mb:.2f} MB")
 if OUTPUT_FORMAT == "parquet":
     print(f"Compression: {COMPRESSION_CODEC}")
 elif OUTPUT_FORMAT == "csv":
@@ -472,10 +796,18 @@ print(f"Execution Duration: {execution_duration_seconds:.2f} seconds")
 print(f"Processing Rate: {deduped_count / execution_duration_seconds if execution_duration_seconds > 0 else 0:.0f} records/sec")
 if ENABLE_KAFKA and KAFKA_BOOTSTRAP_SERVERS:
     print(f"Kafka Notification: Sent to {KAFKA_TOPIC}")
+print(f"Persist Stages: {PERSIST_STAGES} ({PERSIST_STORAGE_LEVEL})")
+print(f"Consolidation Mode: {CONSOLIDATION_MODE}")
+print(f"Dedup Strategy: {DEDUP_STRATEGY}")
+if INCREMENTAL:
+    print(f"New Records: {record_count:,} (merged with {previous_rows:,} previously consolidated)")
+for stage_name, seconds in STAGE_TIMINGS.items():
+    print(f"Stage {stage_name}: {seconds:.1f}s")
 print("=" * 80)
 
 # Log for CloudWatch Logs Insights parsing
 print(f"METRICS: records_processed={deduped_count}, duplicates_removed={removed_duplicates}, output_files={OUTPUT_FILE_COUNT}, output_format={OUTPUT_FORMAT}, duration_seconds={execution_duration_seconds:.2f}, kafka_sent={ENABLE_KAFKA and KAFKA_BOOTSTRAP_SERVERS != ''}")
+print("STAGE_TIMINGS: " + ", ".join(f"{stage_name}_seconds={seconds:.2f}" for stage_name, seconds in STAGE_TIMINGS.items()) + f", persist_stages={PERSIST_STAGES}")
 
 print("\n✓ Consolidation completed successfully!")
 
@@ -483,7 +815,12 @@ print("\n✓ Consolidation completed successfully!")
 # COMMIT JOB
 # =============================================================================
 
-job.commit()
+# Committing advances the job bookmark past the files read in this run; a dry
+# run in incremental mode leaves it where it was so the next run reads them
+if DRY_RUN and INCREMENTAL:
+    print("DRY RUN: job bookmark not committed")
+else:
+    job.commit()
 
 print("\n" + "=" * 80)
 print(f"Job {args['JOB_NAME']} completed successfully")
@@ -0,0 +1,100 @@
+"""
+Deduplication strategies for the chargeback consolidation job
+=============================================================
+
+Keeps the latest row per key and hash-partitions the result by that key in a
+single shuffle, so the deduplicated data is already laid out as the output
+files:
+
+    max_struct  repartition by key, then max(struct(order columns..., row))
+                per key
+    window      repartition by key, then row_number() over the key ordered
+                by the order columns
+
+In both cases the repartition satisfies the key clustering the aggregation or
+window needs, so Spark adds no second exchange. Neither avoids a sort: the
+max() buffer holds a variable-width struct, which Spark 3.1 (Glue 3.0)
+cannot keep in a hash aggregation map, so max_struct is planned as a
+SortAggregate over a per-partition Sort on the key, as the window is. What
+max_struct saves is the window's row numbering and filter; bench_dedup.py
+reports the plan nodes and times of both. The rows ordered first win;
+ties on all order columns keep the largest remaining values under
+max_struct and an arbitrary row under window. Null order values sort lowest
+in both.
+
+Shipped to Glue with --extra-py-files; bench_dedup.py compares the
+strategies locally.
+
+Author: POC Chargeback Team
+"""
+
+from pyspark.sql import Window
+from pyspark.sql import functions as F
+from pyspark.sql.types import ArrayType, MapType, StructType
+
+STRATEGIES = ("max_struct", "window")
+
+_ROW_FIELD = "_row"
+
+
+def _contains_map(data_type):
+    if isinstance(data_type, MapType):
+        return True
+    if isinstance(data_type, ArrayType):
+        return _contains_map(data_type.elementType)
+    if isinstance(data_type, StructType):
+        return any(_contains_map(field.dataType) for field in data_type.fields)
+    return False
+
+
+def _latest_by_max_struct(df, key, order_by):
+    unorderable = [field.name for field in df.schema.fields if _contains_map(field.dataType)]
+    if unorderable:
+        raise ValueError(f"max_struct cannot order map columns {unorderable}; use the window strategy")
+
+    others = [column for column in df.columns if column != key and column not in order_by]
+    fields = [F.col(column) for column in order_by]
+    if others:
+        fields.append(F.struct(*[F.col(column) for column in others]).alias(_ROW_FIELD))
+
+    latest = df.groupBy(key).agg(F.max(F.struct(*fields)).alias("latest"))
+
+    def field(column):
+        if column == key:
+            return F.col(key)
+        if column in order_by:
+            return F.col("latest").getField(column).alias(column)
+        return F.col("latest").getField(_ROW_FIELD).getField(column).alias(column)
+
+    return latest.select(*[field(column) for column in df.columns])
+
+
+def _latest_by_window(df, key, order_by):
+    window = Window.partitionBy(key).orderBy(*[F.col(column).desc() for column in order_by])
+    return df.withColumn("_row_num", F.row_number().over(window)) \
+        .filter(F.col("_row_num") == 1) \
+        .drop("_row_num")
+
+
+def latest_per_key(df, key, order_by, num_partitions, strategy="max_struct"):
+    """
+    Keep the latest row per key, hash-partitioned by key.
+
+    Args:
+        df: Input DataFrame
+        key: Column identifying a record (e.g. chargeback_id)
+        order_by: Columns deciding the latest row, most significant first
+        num_partitions: Output partitions (one output file each)
+        strategy: One of STRATEGIES
+
+    Returns:
+        DataFrame with df's columns and one row per key, in num_partitions
+        partitions hashed on key
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unsupported dedup strategy: {strategy}")
+
+    clustered = df.repartition(num_partitions, key)
+    if strategy == "max_struct":
+        return _latest_by_max_struct(clustered, key, list(order_by))
+    return _latest_by_window(clustered, key, list(order_by))
@@ -0,0 +1,131 @@
+"""
+Benchmark: consolidation updater bulk updates
+=============================================
+
+Compares one synchronous update_item after another (the updater's previous
+loop) with the bulk update engine at several concurrency limits, against a
+local DynamoDB stand-in. The table is created, seeded and deleted by the
+script.
+
+Any DynamoDB-compatible endpoint works, e.g.:
+
+    docker run -d -p 8000:8000 amazon/dynamodb-local
+    # or: pip install "moto[server]" && moto_server -p 8000
+
+Usage:
+    python bench_bulk_update.py [--endpoint-url http://localhost:8000] [--items 5000]
+                                [--concurrency 8 32 64] [--rate-limit 0]
+
+Author: POC Chargeback Team
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+
+import boto3
+from botocore.config import Config
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'consolidation-updater'))
+
+from bulk_update import BulkUpdater  # noqa: E402
+
+UPDATE_EXPRESSION = (
+    'SET consolidation_status = :status, '
+    'consolidation_s3_path = :path, '
+    'consolidation_execution = :execution, '
+    'updated_at = :updated'
+)
+EXPRESSION_VALUES = {
+    ':status': {'S': 'completed'},
+    ':path': {'S': 's3://bucket/consolidated/chargebacks/year=2025/month=11/day=20'},
+    ':execution': {'N': '2'},
+    ':updated': {'S': '2025-11-20T06:45:32Z'},
+}
+
+
+def make_client(args, max_pool_connections=10):
+    return boto3.client(
+        'dynamodb',
+        endpoint_url=args.endpoint_url,
+        region_name='us-east-1',
+        aws_access_key_id='local',
+        aws_secret_access_key='local',
+        config=Config(
+            max_pool_connections=max_pool_connections,
+            retries={'mode': 'standard', 'max_attempts': 1},
+        ),
+    )
+
+
+def create_table(client, table_name, items):
+    client.create_table(
+        TableName=table_name,
+        KeySchema=[{'AttributeName': 'chargeback_id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'chargeback_id', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST',
+    )
+    client.get_waiter('table_exists').wait(TableName=table_name)
+
+    keys = [f"cb_bench_{i:07d}" for i in range(items)]
+    for start in range(0, items, 25):
+        client.batch_write_item(RequestItems={table_name: [
+            {'PutRequest': {'Item': {'chargeback_id': {'S': key}, 'created_at': {'S': '2025-11-20T10:00:00Z'}}}}
+            for key in keys[start:start + 25]
+        ]})
+    return keys
+
+
+def bench_sequential(client, table_name, keys):
+    started = time.perf_counter()
+    for key in keys:
+        client.update_item(
+            TableName=table_name,
+            Key={'chargeback_id': {'S': key}},
+            UpdateExpression=UPDATE_EXPRESSION,
+            ExpressionAttributeValues=EXPRESSION_VALUES,
+            ReturnValues='NONE',
+        )
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--endpoint-url', default='http://localhost:8000', help='DynamoDB-compatible endpoint')
+    parser.add_argument('--items', type=int, default=5000, help='Chargebacks to update per run')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 32, 64], help='Maximum concurrency values')
+    parser.add_argument('--rate-limit', type=float, default=0, help='Token bucket rate (0 = unlimited)')
+    args = parser.parse_args()
+
+    client = make_client(args)
+    table_name = f"bench-bulk-update-{uuid.uuid4().hex[:8]}"
+    print(f"\nSeeding {args.items} items into {table_name} at {args.endpoint_url}...")
+    keys = create_table(client, table_name, args.items)
+
+    try:
+        print(f"\n{'mode':<28} {'seconds':>8} {'items/s':>9} {'failed':>7} {'throttled':>10} {'peak':>5}")
+
+        elapsed = bench_sequential(client, table_name, keys)
+        print(f"{'sequential update_item':<28} {elapsed:8.2f} {len(keys) / elapsed:9.0f} {0:7d} {0:10d} {1:5d}")
+
+        for concurrency in args.concurrency:
+            updater = BulkUpdater(
+                make_client(args, max_pool_connections=concurrency),
+                table_name,
+                key_name='chargeback_id',
+                max_concurrency=concurrency,
+                initial_concurrency=min(8, concurrency),
+                rate_limit=args.rate_limit,
+            )
+            result = updater.run(iter(keys), UPDATE_EXPRESSION, EXPRESSION_VALUES)
+            print(f"{'bulk (max ' + str(concurrency) + ')':<28} {result.elapsed_seconds:8.2f} "
+                  f"{result.succeeded / result.elapsed_seconds:9.0f} {result.failed_count:7d} "
+                  f"{result.throttled:10d} {result.peak_concurrency:5d}")
+    finally:
+        client.delete_table(TableName=table_name)
+
+
+if __name__ == '__main__':
+    main()
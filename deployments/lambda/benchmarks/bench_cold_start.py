@@ -0,0 +1,147 @@
+"""
+Benchmark: stream processor cold start
+======================================
+
+Measures, each in a fresh Python process (like a new Lambda container):
+
+1. Import time of the heavy dependencies (kafka, aws_msk_iam_sasl_signer)
+   and of lambda_function itself.
+2. Init time (module import, including warm-up when enabled) and the
+   latency of the first lambda_handler invocation, with PRODUCER_WARMUP
+   on and off, against a local Kafka stand-in.
+
+The stand-in must speak the Kafka protocol without authentication, e.g.:
+
+    docker run -d -p 9092:9092 redpandadata/redpanda redpanda start \\
+        --overprovisioned --smp 1 --kafka-addr 0.0.0.0:9092 \\
+        --advertise-kafka-addr localhost:9092
+
+Usage:
+    python bench_cold_start.py [--bootstrap localhost:9092] [--topic chargebacks] [--runs 5]
+
+Author: POC Chargeback Team
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STREAM_PROCESSOR_DIR = os.path.join(HERE, '..', 'stream-processor')
+SHARED_DIR = os.path.join(HERE, '..', 'shared')
+
+IMPORT_PROBE = """
+import time
+started = time.perf_counter()
+import {module}
+print(time.perf_counter() - started)
+"""
+
+COLD_START_PROBE = """
+import json, time
+started = time.perf_counter()
+import lambda_function
+init_seconds = time.perf_counter() - started
+
+record = {
+    'eventID': '1',
+    'eventName': 'INSERT',
+    'dynamodb': {
+        'Keys': {'chargeback_id': {'S': 'cb_bench_1'}},
+        'NewImage': {
+            'chargeback_id': {'S': 'cb_bench_1'},
+            'amount': {'N': '150.00'},
+            'status': {'S': 'pending'},
+            'created_at': {'S': '2025-10-22T10:00:00Z'},
+        },
+        'SequenceNumber': '1',
+    },
+    'eventSourceARN': 'arn:aws:dynamodb:us-east-1:123456789:table/chargebacks/stream/2025-10-22T00:00:00.000',
+}
+
+started = time.perf_counter()
+response = lambda_function.lambda_handler({'Records': [record]}, None)
+first_invoke_seconds = time.perf_counter() - started
+
+print(json.dumps({
+    'init': init_seconds,
+    'first_invoke': first_invoke_seconds,
+    'failed': len(response['batchItemFailures']),
+}))
+"""
+
+
+def run_probe(code, env):
+    """Run a probe in a fresh interpreter and return its last stdout line."""
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=STREAM_PROCESSOR_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.strip().splitlines()[-1]
+
+
+def base_env(args):
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': os.pathsep.join([STREAM_PROCESSOR_DIR, SHARED_DIR, env.get('PYTHONPATH', '')]),
+        'MSK_BOOTSTRAP_SERVERS': args.bootstrap,
+        'KAFKA_TOPIC': args.topic,
+        'AWS_REGION': env.get('AWS_REGION', 'us-east-1'),
+        'KAFKA_SECURITY_PROTOCOL': 'PLAINTEXT',
+        'LOG_LEVEL': 'WARNING',
+    })
+    return env
+
+
+def summarize(label, samples):
+    samples_ms = [sample * 1000 for sample in samples]
+    print(f"  {label:<36} median {statistics.median(samples_ms):8.1f} ms   "
+          f"max {max(samples_ms):8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--bootstrap', default='localhost:9092', help='Local Kafka bootstrap servers')
+    parser.add_argument('--topic', default='chargebacks', help='Topic to publish to')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh processes per measurement')
+    args = parser.parse_args()
+
+    print("\nImport time (fresh process each run)")
+    env = base_env(args)
+    env['PRODUCER_WARMUP'] = 'false'
+    for module in ('kafka', 'aws_msk_iam_sasl_signer', 'lambda_function'):
+        try:
+            samples = [float(run_probe(IMPORT_PROBE.format(module=module), env)) for _ in range(args.runs)]
+        except subprocess.CalledProcessError as e:
+            print(f"  {module:<36} failed: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        summarize(module, samples)
+
+    for warmup in ('false', 'true'):
+        env = base_env(args)
+        env['PRODUCER_WARMUP'] = warmup
+
+        print(f"\nPRODUCER_WARMUP={warmup}")
+        try:
+            results = [json.loads(run_probe(COLD_START_PROBE, env)) for _ in range(args.runs)]
+        except subprocess.CalledProcessError as e:
+            print(f"  failed: {e.stderr.strip().splitlines()[-1]}")
+            continue
+
+        summarize('init (module import)', [result['init'] for result in results])
+        summarize('first invocation', [result['first_invoke'] for result in results])
+        summarize('init + first invocation', [result['init'] + result['first_invoke'] for result in results])
+        failed = sum(result['failed'] for result in results)
+        if failed:
+            print(f"  WARNING: {failed} runs reported failed records (is the stand-in running?)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Micro-benchmark: DynamoDB-JSON image deserialization
+====================================================
+
+Compares the stream processor's module-level deserialize_image against the
+per-record nested closure it replaced and against the generic stack-based
+walker applied to the whole image, on realistic NEW_AND_OLD_IMAGES payloads
+(flat chargeback images and images with nested metadata). The closure
+decodes numbers with the configured NUMBER_MODE decoder, so all variants do
+the same number work.
+
+Each chunk of CHUNK_SIZE images is timed --repeat times per variant, with
+the variants interleaved, and the fastest pass per chunk is kept; this
+filters out scheduler noise on small hosts.
+
+Usage:
+    python bench_deserializer.py [--records 20000] [--repeat 5]
+
+Author: POC Chargeback Team
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+# The stream processor reads its configuration at import time
+os.environ.setdefault('MSK_BOOTSTRAP_SERVERS', 'localhost:9092')
+os.environ.setdefault('KAFKA_TOPIC', 'chargebacks')
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('PRODUCER_WARMUP', 'false')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'stream-processor'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+from lambda_function import NUMBER_MODE, _decode_number, _fill_container, deserialize_image  # noqa: E402
+
+CHUNK_SIZE = 1000
+
+
+def legacy_dynamodb_to_dict(ddb_item):
+    """Closure body previously defined inside transform_dynamodb_record"""
+    result = {}
+    for key, value in ddb_item.items():
+        if 'S' in value:
+            result[key] = value['S']
+        elif 'N' in value:
+            result[key] = _decode_number(value['N'])
+        elif 'BOOL' in value:
+            result[key] = value['BOOL']
+        elif 'NULL' in value:
+            result[key] = None
+        elif 'M' in value:
+            result[key] = legacy_dynamodb_to_dict(value['M'])
+        elif 'L' in value:
+            result[key] = [legacy_dynamodb_to_dict({'item': item})['item'] for item in value['L']]
+    return result
+
+
+def flat_image(i):
+    """Chargeback image as written by the API (S/N/BOOL only)"""
+    return {
+        'chargeback_id': {'S': f'cb_{i:010d}'},
+        'merchant_id': {'S': f'merch_{i % 5000}'},
+        'transaction_id': {'S': f'txn_{i:012d}'},
+        'amount': {'N': f'{(i % 100000) / 100:.2f}'},
+        'currency': {'S': 'BRL'},
+        'status': {'S': 'pending'},
+        'reason': {'S': 'Product not received'},
+        'card_last_four': {'S': f'{i % 10000:04d}'},
+        'is_fraud': {'BOOL': i % 7 == 0},
+        'created_at': {'S': '2025-10-22T10:00:00Z'},
+        'updated_at': {'S': '2025-10-22T10:05:00Z'},
+        'version': {'N': str(i % 5)},
+    }
+
+
+def nested_image(i):
+    """Chargeback image with a nested metadata map and history list"""
+    image = flat_image(i)
+    image['metadata'] = {'M': {
+        'channel': {'S': 'web'},
+        'score': {'N': '0.87'},
+        'tags': {'L': [{'S': 'priority'}, {'S': 'retail'}]},
+        'history': {'L': [
+            {'M': {'status': {'S': 'pending'}, 'at': {'S': '2025-10-22T10:00:00Z'}}},
+            {'M': {'status': {'S': 'review'}, 'at': {'S': '2025-10-22T10:05:00Z'}}},
+        ]},
+    }}
+    return image
+
+
+def stack_walker(image):
+    """The generic container walk applied to the whole image"""
+    result = {}
+    _fill_container(result, image)
+    return result
+
+
+def run(variants, images, repeat):
+    """Best time per variant; variants are interleaved so drift hits all alike."""
+    best = {label: 0.0 for label in variants}
+    for start in range(0, len(images), CHUNK_SIZE):
+        chunk = images[start:start + CHUNK_SIZE]
+        passes = {label: [] for label in variants}
+        for _ in range(repeat):
+            for label, func in variants.items():
+                passes[label].append(timeit.timeit(lambda: [func(image) for image in chunk], number=1))
+        for label, durations in passes.items():
+            best[label] += min(durations)
+
+    for label, seconds in best.items():
+        print(f"  {label:<28} {seconds * 1000:9.1f} ms   {len(images) / seconds:12,.0f} images/sec")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--records', type=int, default=20000, help='Stream records per run')
+    parser.add_argument('--repeat', type=int, default=7, help='Timed passes per chunk (fastest is kept)')
+    args = parser.parse_args()
+
+    for name, factory in (('flat', flat_image), ('nested', nested_image)):
+        # NEW_AND_OLD_IMAGES: every MODIFY carries two images
+        images = [factory(i) for i in range(args.records)] * 2
+
+        if NUMBER_MODE != 'minor_units':
+            assert [deserialize_image(image) for image in images[:100]] == \
+                [legacy_dynamodb_to_dict(image) for image in images[:100]] == \
+                [stack_walker(image) for image in images[:100]]
+
+        print(f"\n{name} images ({len(images):,} per run, NUMBER_MODE={NUMBER_MODE})")
+        best = run({
+            'legacy closure': legacy_dynamodb_to_dict,
+            'stack walker': stack_walker,
+            'deserialize_image': deserialize_image,
+        }, images, args.repeat)
+        current = best['deserialize_image']
+        print(f"  speedup: {best['legacy closure'] / current:.2f}x vs legacy closure, "
+              f"{best['stack walker'] / current:.2f}x vs stack walker")
+
+
+if __name__ == '__main__':
+    main()
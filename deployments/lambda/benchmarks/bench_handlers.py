@@ -0,0 +1,338 @@
+"""
+Benchmark: Lambda handlers end to end
+=====================================
+
+Drives both lambda_handler functions with synthetic events and in-process
+fakes, so whole-invocation performance can be tracked without AWS, Kafka or
+Docker:
+
+    stream   stream processor: DynamoDB Stream batches -> fake Kafka producer
+             (records are fully transformed and serialized, only the network
+             send is skipped)
+    updater  consolidation updater: MSK consolidation events -> moto DynamoDB
+             (lookup through the created-date index plus one conditional
+             update per chargeback)
+
+For each suite it reports records/sec, p50/p99 invocation latency and peak
+traced memory (the largest amount allocated during one pass over the
+events, measured in a separate pass under tracemalloc, which slows Python
+down). The updater numbers include moto's own request handling, so
+compare them between runs rather than with DynamoDB.
+
+Results can be saved as a baseline and later runs compared against it; the
+script exits with status 1 when a metric regresses by more than
+--max-regression, which makes it usable as a CI gate.
+
+Needs moto for the updater suite (pip install "moto[dynamodb]"); kafka-python
+is not needed.
+
+Usage:
+    python bench_handlers.py [--suite stream|updater|all] [--records 20000]
+                             [--batch-size 100] [--key-skew 1.2] [--image-size 0]
+                             [--chargebacks 2000] [--dates 4]
+                             [--save baseline.json] [--compare baseline.json]
+
+Author: POC Chargeback Team
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STREAM_PROCESSOR_DIR = os.path.join(HERE, '..', 'stream-processor')
+UPDATER_DIR = os.path.join(HERE, '..', 'consolidation-updater')
+SHARED_DIR = os.path.join(HERE, '..', 'shared')
+
+sys.path[:0] = [HERE, SHARED_DIR, UPDATER_DIR]
+
+os.environ.setdefault('MSK_BOOTSTRAP_SERVERS', 'localhost:9092')
+os.environ.setdefault('KAFKA_TOPIC', 'chargeback-events')
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+os.environ.setdefault('DYNAMODB_TABLE_NAME', 'bench-chargebacks')
+# The updater suite measures the created-date index path (items are seeded with it)
+os.environ.setdefault('PARTITION_LOOKUP_MODE', 'query')
+os.environ.setdefault('PRODUCER_WARMUP', 'false')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('METRICS_MODE', 'off')
+os.environ.setdefault('INSTRUMENTATION_SAMPLE_RATE', '0')
+
+import synthetic_events  # noqa: E402
+
+RecordMetadata = namedtuple('RecordMetadata', ['topic', 'partition', 'offset'])
+
+# Metrics where a higher value is better; all others are lower-is-better
+HIGHER_IS_BETTER = {'records_per_sec'}
+
+
+def load_module(name, directory):
+    """Import a lambda_function.py under its own name (both files share one)."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(directory, 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeFuture:
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.is_done = True
+
+    def get(self, timeout=None):
+        return self.metadata
+
+
+class FakeProducer:
+    """Serializes like KafkaProducer, then acknowledges immediately."""
+
+    def __init__(self, value_serializer):
+        self.value_serializer = value_serializer
+        self.offset = 0
+        self.bytes_sent = 0
+
+    def send(self, topic, key=None, value=None):
+        payload = self.value_serializer(value)
+        key_bytes = key.encode('utf-8') if key else b''
+        self.bytes_sent += len(payload) + len(key_bytes)
+        self.offset += 1
+        return FakeFuture(RecordMetadata(topic, 0, self.offset))
+
+    def flush(self, timeout=None):
+        pass
+
+    def close(self, timeout=None):
+        pass
+
+
+class FakeContext:
+    function_name = 'bench'
+    aws_request_id = 'bench'
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789:function:bench'
+
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(latencies, records, elapsed, peak_bytes):
+    return {
+        'invocations': len(latencies),
+        'records': records,
+        'records_per_sec': round(records / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'peak_mem_mb': round(peak_bytes / (1024 * 1024), 2),
+    }
+
+
+def measure(invoke, events, count_records, iterations):
+    """
+    Run every event through invoke `iterations` times, then once more under
+    tracemalloc for the memory peak.
+
+    Returns:
+        Summary dict (see summarize)
+    """
+    invoke(events[0])  # warm-up: lazy imports, first producer/client use
+
+    latencies = []
+    records = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for event in events:
+            invocation_started = time.perf_counter()
+            invoke(event)
+            latencies.append(time.perf_counter() - invocation_started)
+            records += count_records(event)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    for event in events:
+        invoke(event)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return summarize(latencies, records, elapsed, peak_bytes)
+
+
+def bench_stream(args):
+    module = load_module('stream_processor_lambda', STREAM_PROCESSOR_DIR)
+    producer = FakeProducer(module.serialize_event)
+    module.producer_manager.producer = producer
+
+    records = synthetic_events.stream_records(
+        args.records,
+        key_space=args.key_space,
+        skew=args.key_skew,
+        metadata_ratio=args.metadata_ratio,
+        padding_bytes=args.image_size,
+        nested=args.nested,
+    )
+    events = list(synthetic_events.stream_batches(records, args.batch_size))
+    context = FakeContext()
+
+    def invoke(event):
+        response = module.lambda_handler(event, context)
+        if response['batchItemFailures']:
+            raise RuntimeError(f"stream processor reported failures: {response['batchItemFailures'][:3]}")
+
+    result = measure(invoke, events, lambda event: len(event['Records']), args.iterations)
+    result['bytes_per_record'] = round(producer.bytes_sent / max(producer.offset, 1), 1)
+    return result
+
+
+def create_chargebacks_table(client, table_name, index_name):
+    client.create_table(
+        TableName=table_name,
+        KeySchema=[{'AttributeName': 'chargeback_id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'chargeback_id', 'AttributeType': 'S'},
+            {'AttributeName': 'created_date_bucket', 'AttributeType': 'S'},
+        ],
+        GlobalSecondaryIndexes=[{
+            'IndexName': index_name,
+            'KeySchema': [
+                {'AttributeName': 'created_date_bucket', 'KeyType': 'HASH'},
+                {'AttributeName': 'chargeback_id', 'KeyType': 'RANGE'},
+            ],
+            'Projection': {'ProjectionType': 'KEYS_ONLY'},
+        }],
+        BillingMode='PAY_PER_REQUEST',
+    )
+
+
+def bench_updater(args):
+    from moto import mock_aws
+
+    with mock_aws():
+        import boto3
+
+        client = boto3.client('dynamodb', region_name=os.environ['AWS_REGION'])
+        table_name = os.environ['DYNAMODB_TABLE_NAME']
+        index_name = os.environ.get('CREATED_DATE_INDEX_NAME', 'created-date-index')
+        create_chargebacks_table(client, table_name, index_name)
+
+        # The module creates its boto3 clients at import, so import it inside the mock
+        module = load_module('consolidation_updater_lambda', UPDATER_DIR)
+
+        # Key skew spreads the chargebacks unevenly over the partition dates
+        weights = [1.0 / (rank ** args.key_skew) for rank in range(1, args.dates + 1)]
+        dates = [f"2025-10-{day:02d}" for day in range(1, args.dates + 1)]
+        per_date = {}
+        for partition_date, weight in zip(dates, weights):
+            per_date[partition_date] = max(1, int(args.chargebacks * weight / sum(weights)))
+            synthetic_events.seed_chargebacks(
+                client, table_name, partition_date, per_date[partition_date],
+                bucket_for=lambda chargeback_id, d=partition_date: module.created_date_bucket(
+                    d, module.created_date_shard(chargeback_id)
+                ),
+            )
+
+        # A new execution sequence per invocation, so conditional updates
+        # always write instead of skipping every chargeback after the first run
+        sequence = [0]
+
+        def next_event(partition_date):
+            sequence[0] += 1
+            return synthetic_events.consolidation_event(partition_date, sequence[0], per_date[partition_date])
+
+        context = FakeContext()
+
+        def invoke(partition_date):
+            event = synthetic_events.msk_event([next_event(partition_date)])
+            response = module.lambda_handler(event, context)
+            if response['batchItemFailures']:
+                raise RuntimeError(f"consolidation updater reported failures for {partition_date}")
+
+        return measure(invoke, dates, lambda partition_date: per_date[partition_date], args.iterations)
+
+
+SUITES = {'stream': bench_stream, 'updater': bench_updater}
+
+
+def compare(results, baseline, max_regression):
+    """
+    Print the change against a baseline.
+
+    Returns:
+        List of 'suite.metric' names that regressed beyond max_regression
+    """
+    regressions = []
+    print(f"\n{'suite':<10} {'metric':<18} {'baseline':>12} {'current':>12} {'change':>8}")
+    for suite, metrics in results.items():
+        for metric in ('records_per_sec', 'p50_ms', 'p99_ms', 'peak_mem_mb'):
+            before = baseline.get(suite, {}).get(metric)
+            if not before:
+                continue
+            after = metrics[metric]
+            change = (after - before) / before
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = '  REGRESSION' if worse > max_regression else ''
+            print(f"{suite:<10} {metric:<18} {before:12.2f} {after:12.2f} {change:+8.1%}{flag}")
+            if flag:
+                regressions.append(f"{suite}.{metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--suite', choices=['stream', 'updater', 'all'], default='all')
+    parser.add_argument('--records', type=int, default=20000, help='Stream records (stream)')
+    parser.add_argument('--batch-size', type=int, default=100, help='Stream records per invocation')
+    parser.add_argument('--key-space', type=int, default=10000, help='Distinct chargebacks in the stream')
+    parser.add_argument('--key-skew', type=float, default=0.0,
+                        help='Zipf exponent for chargeback keys (stream) and date sizes (updater); 0 = uniform')
+    parser.add_argument('--metadata-ratio', type=float, default=0.0,
+                        help='Fraction of MODIFY records that only change consolidation metadata')
+    parser.add_argument('--image-size', type=int, default=0, help='Extra bytes per stream image')
+    parser.add_argument('--nested', action='store_true', help='Add a nested map to every stream image')
+    parser.add_argument('--chargebacks', type=int, default=2000, help='Chargebacks over all dates (updater)')
+    parser.add_argument('--dates', type=int, default=4, help='Partition dates (updater)')
+    parser.add_argument('--iterations', type=int, default=3, help='Timed passes over the events')
+    parser.add_argument('--save', metavar='FILE', help='Write the results as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='Compare with results saved by --save')
+    parser.add_argument('--max-regression', type=float, default=0.15,
+                        help='Allowed relative regression per metric with --compare')
+    args = parser.parse_args()
+
+    suites = list(SUITES) if args.suite == 'all' else [args.suite]
+    results = {}
+
+    print(f"\n{'suite':<10} {'records/s':>11} {'p50 ms':>9} {'p99 ms':>9} {'peak MiB':>9}")
+    for suite in suites:
+        result = SUITES[suite](args)
+        results[suite] = result
+        print(f"{suite:<10} {result['records_per_sec']:11.0f} {result['p50_ms']:9.2f} "
+              f"{result['p99_ms']:9.2f} {result['peak_mem_mb']:9.2f}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\nSaved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"\nRegressed beyond {args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
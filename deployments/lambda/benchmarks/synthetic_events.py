@@ -0,0 +1,241 @@
+"""
+Synthetic events for the Lambda benchmarks
+==========================================
+
+Generators for DynamoDB Stream events (stream processor input), MSK
+consolidation events (consolidation updater input) and the chargeback items
+the updater looks up, with configurable sizes and key skew.
+
+Key skew follows a Zipf-like distribution over a fixed key space: with
+skew=0 every key is equally likely; with skew=1.2 a handful of chargebacks
+receive most of the updates, as in a burst of status changes on disputed
+items.
+
+Author: POC Chargeback Team
+"""
+
+import base64
+import itertools
+import json
+import random
+import time
+from typing import Dict, Iterator, List, Optional
+
+STREAM_ARN = 'arn:aws:dynamodb:us-east-1:123456789:table/chargebacks/stream/2025-10-22T00:00:00.000'
+
+STATUSES = ('pending', 'under_review', 'accepted', 'rejected', 'won', 'lost')
+
+
+class KeySampler:
+    """Draws key indexes in [0, key_space) with Zipf-like skew."""
+
+    def __init__(self, key_space: int, skew: float, rng: random.Random):
+        self.rng = rng
+        self.key_space = key_space
+        if skew > 0:
+            weights = [1.0 / (rank ** skew) for rank in range(1, key_space + 1)]
+            self.cum_weights = list(itertools.accumulate(weights))
+        else:
+            self.cum_weights = None
+
+    def sample(self) -> int:
+        if self.cum_weights is None:
+            return self.rng.randrange(self.key_space)
+        return self.rng.choices(range(self.key_space), cum_weights=self.cum_weights)[0]
+
+
+def chargeback_image(index: int, version: int = 0, padding_bytes: int = 0, nested: bool = False) -> Dict:
+    """DynamoDB-JSON chargeback image, as written by the API."""
+    image = {
+        'chargeback_id': {'S': f'cb_{index:010d}'},
+        'merchant_id': {'S': f'merch_{index % 5000}'},
+        'transaction_id': {'S': f'txn_{index:012d}'},
+        'amount': {'N': f'{(index % 100000) / 100:.2f}'},
+        'currency': {'S': 'BRL'},
+        'status': {'S': STATUSES[version % len(STATUSES)]},
+        'reason': {'S': 'Product not received'},
+        'card_last_four': {'S': f'{index % 10000:04d}'},
+        'is_fraud': {'BOOL': index % 7 == 0},
+        'created_at': {'S': '2025-10-22T10:00:00Z'},
+        'updated_at': {'S': f'2025-10-22T10:{version % 60:02d}:00Z'},
+        'version': {'N': str(version)},
+    }
+    if nested:
+        image['metadata'] = {'M': {
+            'channel': {'S': 'web'},
+            'score': {'N': '0.87'},
+            'tags': {'L': [{'S': 'priority'}, {'S': 'retail'}]},
+            'history': {'L': [
+                {'M': {'status': {'S': STATUSES[v % len(STATUSES)]}, 'at': {'S': '2025-10-22T10:00:00Z'}}}
+                for v in range(version % 4 + 1)
+            ]},
+        }}
+    if padding_bytes:
+        image['notes'] = {'S': 'x' * padding_bytes}
+    return image
+
+
+def consolidation_metadata(image: Dict) -> Dict:
+    """The same image after the consolidation updater wrote its metadata."""
+    updated = dict(image)
+    updated.update({
+        'consolidation_status': {'S': 'completed'},
+        'consolidation_s3_path': {'S': 's3://bucket/consolidated/chargebacks/year=2025/month=10/day=22'},
+        'consolidation_date': {'S': '2025-10-22T06:45:32+00:00'},
+        'consolidation_execution': {'N': '2'},
+        'updated_at': {'S': '2025-10-22T06:45:33Z'},
+    })
+    return updated
+
+
+def stream_records(
+    count: int,
+    key_space: int = 10000,
+    skew: float = 0.0,
+    insert_ratio: float = 0.2,
+    metadata_ratio: float = 0.0,
+    padding_bytes: int = 0,
+    nested: bool = False,
+    seed: int = 42,
+) -> List[Dict]:
+    """
+    DynamoDB Stream records (NEW_AND_OLD_IMAGES) in stream order.
+
+    Args:
+        count: Number of records
+        key_space: Distinct chargebacks
+        skew: Zipf exponent for key selection (0 = uniform)
+        insert_ratio: Fraction of INSERT records; the rest are MODIFY
+        metadata_ratio: Fraction of MODIFY records that only change
+            consolidation metadata (suppressed by the stream processor)
+        padding_bytes: Extra string attribute size per image
+        nested: Add a nested metadata map to every image
+        seed: Random seed, for repeatable runs
+
+    Returns:
+        List of stream records
+    """
+    rng = random.Random(seed)
+    keys = KeySampler(key_space, skew, rng)
+    versions: Dict[int, int] = {}
+    now = time.time()
+    records = []
+
+    for sequence in range(count):
+        index = keys.sample()
+        stream_data = {
+            'Keys': {'chargeback_id': {'S': f'cb_{index:010d}'}},
+            'SequenceNumber': str(100000000000000000000 + sequence),
+            'SizeBytes': 512 + padding_bytes,
+            'StreamViewType': 'NEW_AND_OLD_IMAGES',
+            'ApproximateCreationDateTime': now,
+        }
+
+        if index not in versions or rng.random() < insert_ratio:
+            versions[index] = 0
+            event_name = 'INSERT'
+            stream_data['NewImage'] = chargeback_image(index, 0, padding_bytes, nested)
+        else:
+            version = versions[index]
+            old_image = chargeback_image(index, version, padding_bytes, nested)
+            event_name = 'MODIFY'
+            if rng.random() < metadata_ratio:
+                new_image = consolidation_metadata(old_image)
+            else:
+                versions[index] = version + 1
+                new_image = chargeback_image(index, version + 1, padding_bytes, nested)
+            stream_data['OldImage'] = old_image
+            stream_data['NewImage'] = new_image
+
+        records.append({
+            'eventID': f'{sequence:032x}',
+            'eventName': event_name,
+            'eventVersion': '1.1',
+            'eventSource': 'aws:dynamodb',
+            'awsRegion': 'us-east-1',
+            'dynamodb': stream_data,
+            'eventSourceARN': STREAM_ARN,
+        })
+
+    return records
+
+
+def stream_batches(records: List[Dict], batch_size: int) -> Iterator[Dict]:
+    """Split stream records into DynamoDB Streams Lambda events."""
+    for start in range(0, len(records), batch_size):
+        yield {'Records': records[start:start + batch_size]}
+
+
+def consolidation_event(partition_date: str, execution_sequence: int, records_processed: int = 0) -> Dict:
+    """Consolidation event as published by the Glue job."""
+    return {
+        'event_type': 'consolidation_completed',
+        'partition_date': partition_date,
+        'execution_sequence': execution_sequence,
+        'total_executions': 4,
+        'records_processed': records_processed,
+        'duplicates_removed': 0,
+        'output_files': 10,
+        'output_format': 'csv',
+        'output_path': f's3://bucket/consolidated/chargebacks/{partition_date}',
+        'execution_time': f'{partition_date}T06:30:00',
+        'completed_at': f'{partition_date}T06:45:{execution_sequence % 60:02d}.000000+00:00',
+        'job_name': 'poc-chargeback-bench-chargebacks-consolidation',
+    }
+
+
+def msk_event(events: List[Dict], topic: str = 'chargeback-consolidation-events', offset: int = 0) -> Dict:
+    """MSK Lambda event carrying consolidation events as base64 JSON values."""
+    return {
+        'eventSource': 'aws:kafka',
+        'eventSourceArn': 'arn:aws:kafka:us-east-1:123456789:cluster/bench',
+        'records': {
+            f'{topic}-0': [
+                {
+                    'topic': topic,
+                    'partition': 0,
+                    'offset': offset + i,
+                    'timestamp': int(time.time() * 1000),
+                    'timestampType': 'CREATE_TIME',
+                    'key': '',
+                    'value': base64.b64encode(json.dumps(event).encode('utf-8')).decode('ascii'),
+                    'headers': [],
+                }
+                for i, event in enumerate(events)
+            ]
+        },
+    }
+
+
+def seed_chargebacks(
+    client,
+    table_name: str,
+    partition_date: str,
+    count: int,
+    bucket_for: Optional[callable] = None,
+) -> None:
+    """
+    Write `count` chargebacks created on partition_date with batch_write_item.
+
+    Args:
+        client: Low-level DynamoDB client
+        table_name: Chargebacks table
+        partition_date: YYYY-MM-DD
+        count: Number of items
+        bucket_for: chargeback_id -> created_date_bucket value (omit for
+            scan-only tables)
+    """
+    for start in range(0, count, 25):
+        requests = []
+        for index in range(start, min(start + 25, count)):
+            chargeback_id = f'cb_{partition_date}_{index:08d}'
+            item = {
+                'chargeback_id': {'S': chargeback_id},
+                'created_at': {'S': f'{partition_date}T10:00:00Z'},
+                'status': {'S': 'pending'},
+                'amount': {'N': '150.00'},
+            }
+            if bucket_for is not None:
+                item['created_date_bucket'] = {'S': bucket_for(chargeback_id)}
+            requests.append({'PutRequest': {'Item': item}})
+        client.batch_write_item(RequestItems={table_name: requests})
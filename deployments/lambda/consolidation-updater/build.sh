@@ -30,7 +30,11 @@ fi
 
 # Copy Lambda function code
 echo "Copying Lambda function code..."
-cp lambda_function.py package/
+cp lambda_function.py bulk_update.py checkpoint_store.py message_batch.py package/
+
+# Copy modules shared between the Lambda functions
+echo "Copying shared modules..."
+cp ../shared/*.py package/
 
 # Create deployment package
 echo "Creating deployment ZIP..."
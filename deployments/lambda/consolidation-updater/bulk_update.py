@@ -0,0 +1,342 @@
+"""
+Bulk Update - concurrent, rate-limited DynamoDB UpdateItem engine
+=================================================================
+
+Applies the same update to a stream of chargeback keys with a bounded thread
+pool instead of one synchronous update_item after another.
+
+- A token bucket caps the request rate (requests/second) across all threads.
+- Concurrency adapts (AIMD): the number of in-flight requests grows by one
+  after every CONCURRENCY_INCREASE_AFTER consecutive successes and is halved
+  when DynamoDB throttles (once per CONCURRENCY_DECREASE_COOLDOWN_SECONDS).
+- Throttled and transient (5xx) requests are retried with full-jitter
+  exponential backoff; every other error fails the item immediately.
+- A ConditionalCheckFailedException (the item already holds this or a newer
+  update) is counted as skipped, not failed.
+- The result reports exactly which keys succeeded and which failed.
+
+Keys are pulled from the input iterator only when a slot frees up, so a
+streamed partition lookup is never buffered in full.
+
+Author: POC Chargeback Team
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+logger = logging.getLogger(__name__)
+
+# Error codes retried with backoff
+THROTTLING_ERROR_CODES = frozenset({
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+})
+TRANSIENT_ERROR_CODES = frozenset({
+    'InternalServerError',
+    'ServiceUnavailable',
+})
+
+# The ConditionExpression rejected the update: nothing to do for this item
+CONDITION_FAILED_ERROR_CODE = 'ConditionalCheckFailedException'
+
+# Consecutive successes before the concurrency limit grows by one
+CONCURRENCY_INCREASE_AFTER = 20
+
+# Throttles reported by requests that were already in flight when the limit
+# was last halved belong to the same congestion event and are not counted again
+CONCURRENCY_DECREASE_COOLDOWN_SECONDS = 0.2
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Tokens refill continuously at `rate` per second up to `burst`; acquire()
+    blocks until a token is available. A rate <= 0 disables limiting.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take one token, sleeping until one is available."""
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class AdaptiveLimit:
+    """
+    AIMD limit on in-flight requests, between 1 and `maximum`.
+
+    acquire() blocks while the limit is reached and release() frees the
+    slot; on_success() and on_throttle() move the limit.
+    """
+
+    def __init__(self, initial: int, maximum: int):
+        self.maximum = max(1, maximum)
+        self.limit = min(max(1, initial), self.maximum)
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = float('-inf')
+        self._condition = threading.Condition()
+
+        # Metrics
+        self.peak = self.limit
+        self.decreases = 0
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self) -> None:
+        with self._condition:
+            self._successes += 1
+            if self._successes >= CONCURRENCY_INCREASE_AFTER and self.limit < self.maximum:
+                self._successes = 0
+                self.limit += 1
+                self.peak = max(self.peak, self.limit)
+                self._condition.notify()
+
+    def on_throttle(self) -> None:
+        with self._condition:
+            self._successes = 0
+            now = time.monotonic()
+            if self.limit > 1 and now - self._last_decrease >= CONCURRENCY_DECREASE_COOLDOWN_SECONDS:
+                self.limit = max(1, self.limit // 2)
+                self.decreases += 1
+                self._last_decrease = now
+
+
+@dataclass
+class BulkUpdateResult:
+    """Outcome of a bulk update run."""
+
+    succeeded: int = 0
+    skipped: int = 0
+    failed: List[Tuple[str, str]] = field(default_factory=list)
+    attempts: int = 0
+    throttled: int = 0
+    elapsed_seconds: float = 0.0
+    peak_concurrency: int = 0
+    concurrency_decreases: int = 0
+    stopped: bool = False
+    # Per-key completion time (including retries), in ms rounded to 0.1 -> count
+    latency_ms: Counter = field(default_factory=Counter)
+
+    @property
+    def failed_count(self) -> int:
+        return len(self.failed)
+
+    def stats(self) -> Dict[str, Any]:
+        """Summary for the METRICS log line."""
+        rate = self.succeeded / self.elapsed_seconds if self.elapsed_seconds else 0.0
+        return {
+            'updates_succeeded': self.succeeded,
+            'updates_skipped': self.skipped,
+            'updates_failed': self.failed_count,
+            'update_attempts': self.attempts,
+            'updates_throttled': self.throttled,
+            'peak_concurrency': self.peak_concurrency,
+            'concurrency_decreases': self.concurrency_decreases,
+            'updates_per_second': round(rate, 1),
+        }
+
+
+class BulkUpdater:
+    """
+    Runs one UpdateItem request per key with bounded, adaptive concurrency.
+
+    The update is given in low-level (typed) form and reused for every key,
+    so attribute values are serialized once per run instead of per item.
+    The client should be created with botocore retries disabled
+    (max_attempts=1) so throttling is handled here, where it also drives
+    the concurrency limit.
+    """
+
+    def __init__(
+        self,
+        client,
+        table_name: str,
+        key_name: str,
+        max_concurrency: int = 32,
+        initial_concurrency: int = 8,
+        rate_limit: float = 0,
+        max_attempts: int = 8,
+        backoff_base_seconds: float = 0.05,
+        backoff_max_seconds: float = 5.0,
+    ):
+        self.client = client
+        self.table_name = table_name
+        self.key_name = key_name
+        self.max_concurrency = max(1, max_concurrency)
+        self.initial_concurrency = initial_concurrency
+        self.rate_limit = rate_limit
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self._executor = None
+
+    def run(
+        self,
+        keys: Iterable[str],
+        update_expression: str,
+        expression_attribute_values: Dict[str, Dict[str, Any]],
+        condition_expression: Optional[str] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+    ) -> BulkUpdateResult:
+        """
+        Apply the update to every key.
+
+        Args:
+            keys: String partition key values (may be a lazy iterator)
+            update_expression: UpdateExpression shared by every item
+            expression_attribute_values: Typed values, e.g. {':s': {'S': 'x'}}
+            condition_expression: Optional ConditionExpression
+            should_stop: Checked before each key; when it returns True no
+                further keys are taken, in-flight updates finish and the
+                result is marked stopped
+
+        Returns:
+            BulkUpdateResult with per-key failures
+        """
+        result = BulkUpdateResult()
+        limit = AdaptiveLimit(self.initial_concurrency, self.max_concurrency)
+        bucket = TokenBucket(self.rate_limit)
+        lock = threading.Lock()
+
+        request = {
+            'TableName': self.table_name,
+            'UpdateExpression': update_expression,
+            'ExpressionAttributeValues': expression_attribute_values,
+            'ReturnValues': 'NONE',
+        }
+        if condition_expression:
+            request['ConditionExpression'] = condition_expression
+
+        def update(key: str) -> None:
+            key_started = time.perf_counter()
+            try:
+                error, attempts, throttled = self._update_with_retries(request, key, bucket, limit)
+            except Exception as e:
+                error, attempts, throttled = f"{type(e).__name__}: {e}", 1, 0
+            finally:
+                limit.release()
+
+            latency = round((time.perf_counter() - key_started) * 1000, 1)
+
+            with lock:
+                result.latency_ms[latency] += 1
+                result.attempts += attempts
+                result.throttled += throttled
+                if error is None:
+                    result.succeeded += 1
+                elif error == CONDITION_FAILED_ERROR_CODE:
+                    result.skipped += 1
+                else:
+                    result.failed.append((key, error))
+
+        started = time.monotonic()
+        executor = self._get_executor()
+        futures = []
+
+        for key in keys:
+            if should_stop is not None and should_stop():
+                result.stopped = True
+                break
+
+            # Blocks while the adaptive limit is reached, which also keeps
+            # the lazy key iterator from being drained ahead of the workers
+            limit.acquire()
+            futures.append(executor.submit(update, key))
+
+            if len(futures) >= 4 * self.max_concurrency:
+                futures = [f for f in futures if not f.done()]
+
+        for future in futures:
+            future.result()
+
+        result.elapsed_seconds = time.monotonic() - started
+        result.peak_concurrency = limit.peak
+        result.concurrency_decreases = limit.decreases
+        return result
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Kept across runs (and warm invocations) so threads are reused
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='bulk-update')
+        return self._executor
+
+    def _update_with_retries(
+        self,
+        request: Dict[str, Any],
+        key: str,
+        bucket: TokenBucket,
+        limit: AdaptiveLimit,
+    ) -> Tuple[Optional[str], int, int]:
+        """
+        Returns:
+            (error code or None, attempts made, throttled attempts);
+            CONDITION_FAILED_ERROR_CODE means the item was skipped
+        """
+        throttled = 0
+
+        for attempt in range(1, self.max_attempts + 1):
+            bucket.acquire()
+            try:
+                self.client.update_item(Key={self.key_name: {'S': key}}, **request)
+                limit.on_success()
+                return None, attempt, throttled
+
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code', 'Unknown')
+                if code in THROTTLING_ERROR_CODES:
+                    throttled += 1
+                    limit.on_throttle()
+                elif code not in TRANSIENT_ERROR_CODES:
+                    return code, attempt, throttled
+                last_error = code
+
+            except BotoCoreError as e:
+                # Connection and read-timeout errors
+                last_error = type(e).__name__
+
+            if attempt < self.max_attempts:
+                # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+                time.sleep(random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt)))
+
+        logger.debug(f"Giving up on {key} after {self.max_attempts} attempts: {last_error}")
+        return last_error, self.max_attempts, throttled
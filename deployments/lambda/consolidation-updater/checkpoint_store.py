@@ -0,0 +1,133 @@
+"""
+Checkpoint Store - progress of consolidation updates split into work units
+==========================================================================
+
+A consolidation event is split into work units (one per created-date shard
+in query mode, one per scan segment in scan mode). Each completed unit is
+recorded on a checkpoint item, so a retried Kafka message only processes the
+units that are still missing, and parallel invocations can report their
+units independently.
+
+Checkpoint item (DynamoDB, partition key checkpoint_id):
+    checkpoint_id        "<partition_date>#<execution_sequence>#<completed_at>"
+    completed_units      String set of finished work unit ids
+    total_units          Number of units the event was split into
+    chargebacks_found    Running total over completed units
+    chargebacks_updated  Running total over completed units
+    chargebacks_skipped  Running total over completed units
+    chargebacks_failed   Running total over completed units
+    updated_at           Last checkpoint write
+    expires_at           Epoch seconds, for DynamoDB TTL
+
+Units are added with ADD, which is atomic, so concurrent writers never lose
+each other's progress.
+
+Author: POC Chargeback Team
+"""
+
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+def checkpoint_id_for(consolidation_event: Dict[str, Any]) -> str:
+    """
+    Checkpoint key of a consolidation event.
+
+    completed_at is part of the key so a re-run of the same Glue execution
+    starts a new checkpoint instead of being skipped as already done.
+    """
+    return (
+        f"{consolidation_event['partition_date']}"
+        f"#{consolidation_event['execution_sequence']}"
+        f"#{consolidation_event['completed_at']}"
+    )
+
+
+class CheckpointStore:
+    """Reads and records completed work units on a DynamoDB table."""
+
+    def __init__(self, table, ttl_days: int = 7):
+        self.table = table
+        self.ttl_seconds = ttl_days * 86400
+
+    def completed_units(self, checkpoint_id: str) -> Set[str]:
+        """
+        Work unit ids already completed for a checkpoint.
+
+        Args:
+            checkpoint_id: Key from checkpoint_id_for
+
+        Returns:
+            Set of unit ids (empty for a new checkpoint)
+        """
+        response = self.table.get_item(
+            Key={'checkpoint_id': checkpoint_id},
+            ProjectionExpression='completed_units',
+            ConsistentRead=True,
+        )
+        return set(response.get('Item', {}).get('completed_units', set()))
+
+    def chargebacks_found(self, checkpoint_id: str) -> Optional[int]:
+        """
+        Chargebacks found by the completed units of a checkpoint.
+
+        Args:
+            checkpoint_id: Key from checkpoint_id_for
+
+        Returns:
+            Running total, or None if no unit has recorded it
+        """
+        response = self.table.get_item(
+            Key={'checkpoint_id': checkpoint_id},
+            ProjectionExpression='chargebacks_found',
+            ConsistentRead=True,
+        )
+        found = response.get('Item', {}).get('chargebacks_found')
+        return None if found is None else int(found)
+
+    def complete_unit(
+        self,
+        checkpoint_id: str,
+        unit_id: str,
+        total_units: int,
+        found: int,
+        updated: int,
+        skipped: int,
+        failed: int,
+    ) -> None:
+        """
+        Record a finished work unit and add its counts.
+
+        Args:
+            checkpoint_id: Key from checkpoint_id_for
+            unit_id: Work unit id
+            total_units: Number of units of the event
+            found: Chargebacks the unit's lookup returned
+            updated: Chargebacks updated by the unit
+            skipped: Chargebacks that already held this or a newer execution
+            failed: Chargebacks that failed in the unit
+        """
+        self.table.update_item(
+            Key={'checkpoint_id': checkpoint_id},
+            UpdateExpression=(
+                'ADD completed_units :unit, chargebacks_found :found, chargebacks_updated :updated, '
+                'chargebacks_skipped :skipped, chargebacks_failed :failed '
+                'SET total_units = :total, updated_at = :now, expires_at = :expires'
+            ),
+            ExpressionAttributeValues={
+                ':unit': {unit_id},
+                ':found': found,
+                ':updated': updated,
+                ':skipped': skipped,
+                ':failed': failed,
+                ':total': total_units,
+                ':now': datetime.utcnow().isoformat() + 'Z',
+                ':expires': int(time.time()) + self.ttl_seconds,
+            },
+        )
+
+        logger.debug(f"Checkpoint {checkpoint_id}: unit {unit_id} completed")
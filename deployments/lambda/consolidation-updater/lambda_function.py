@@ -12,28 +12,152 @@ Author: AWS POC Chargeback Team
 
 import json
 import os
-import base64
+import queue
+import threading
+import time
+import zlib
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Callable, Iterable, Iterator, Optional, Tuple
 import logging
 
 import boto3
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeSerializer
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+from bulk_update import BulkUpdater, BulkUpdateResult
+from checkpoint_store import CheckpointStore, checkpoint_id_for
+from event_codec import decode_json, encode_json
+from instrumentation import Instrumentation
+from message_batch import parse_batch, superseded_messages
+from metrics import MetricsBuffer
+
 # Configure logging
 logger = logging.getLogger()
 log_level = os.environ.get('LOG_LEVEL', 'INFO')
 logger.setLevel(getattr(logging, log_level))
 
 # Initialize AWS clients
-dynamodb = boto3.resource('dynamodb', region_name=os.environ.get('AWS_REGION', 'sa-east-1'))
-cloudwatch = boto3.client('cloudwatch', region_name=os.environ.get('AWS_REGION', 'sa-east-1'))
+AWS_REGION = os.environ.get('AWS_REGION', 'sa-east-1')
+dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
+cloudwatch = boto3.client('cloudwatch', region_name=AWS_REGION)
+
+# CloudWatch metrics (see metrics.py)
+# emf: Embedded Metric Format log lines, no API calls; api: one batched
+# put_metric_data per invocation; off: disabled
+METRICS_MODE = os.environ.get('METRICS_MODE', 'emf').lower()
+metrics = MetricsBuffer('POC-Chargeback/ConsolidationUpdater', METRICS_MODE, client=cloudwatch)
+
+# Per-stage timing breakdown (see instrumentation.py)
+# A TIMINGS: line is logged for this fraction of invocations (0 disables);
+# OTEL_TRACING also exports the stages as OpenTelemetry spans
+INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('INSTRUMENTATION_SAMPLE_RATE', '1'))
+OTEL_TRACING = os.environ.get('OTEL_TRACING', 'false').lower() == 'true'
+instrumentation = Instrumentation('consolidation-updater', INSTRUMENTATION_SAMPLE_RATE, OTEL_TRACING)
 
 # Get table name from environment
 TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'poc-chargeback-chargebacks-dev')
 table = dynamodb.Table(TABLE_NAME)
 
+# Partition lookup
+# query: paginated Query on the created-date GSI, across all date shards;
+#        needs every item to carry created_date_bucket (writer + backfill)
+# scan: table Scan filtered on created_at (no index required, default)
+PARTITION_LOOKUP_MODE = os.environ.get('PARTITION_LOOKUP_MODE', 'scan').lower()
+CREATED_DATE_INDEX_NAME = os.environ.get('CREATED_DATE_INDEX_NAME', 'created-date-index')
+CREATED_DATE_SHARDS = int(os.environ.get('CREATED_DATE_SHARDS', '16'))
+
+# Scan fallback: parallel segments and how many result pages may be buffered
+# between the scanning threads and the update loop
+SCAN_TOTAL_SEGMENTS = int(os.environ.get('SCAN_TOTAL_SEGMENTS', '4'))
+SCAN_MAX_BUFFERED_PAGES = int(os.environ.get('SCAN_MAX_BUFFERED_PAGES', '8'))
+
+# Bulk update engine (see bulk_update.py)
+# Concurrency starts at UPDATE_INITIAL_CONCURRENCY, grows on success and is
+# halved on throttling; UPDATE_RATE_LIMIT caps UpdateItem calls per second
+# (0 = unlimited). Throttled calls are retried with jittered backoff.
+UPDATE_MAX_CONCURRENCY = int(os.environ.get('UPDATE_MAX_CONCURRENCY', '32'))
+UPDATE_INITIAL_CONCURRENCY = int(os.environ.get('UPDATE_INITIAL_CONCURRENCY', '8'))
+UPDATE_RATE_LIMIT = float(os.environ.get('UPDATE_RATE_LIMIT', '0'))
+UPDATE_MAX_ATTEMPTS = int(os.environ.get('UPDATE_MAX_ATTEMPTS', '8'))
+UPDATE_BACKOFF_BASE_SECONDS = float(os.environ.get('UPDATE_BACKOFF_BASE_SECONDS', '0.05'))
+UPDATE_BACKOFF_MAX_SECONDS = float(os.environ.get('UPDATE_BACKOFF_MAX_SECONDS', '5'))
+
+# Low-level client shared by the update threads (clients are thread-safe,
+# resources are not). botocore retries are off so throttling reaches the
+# engine, which uses it to back off and reduce concurrency.
+dynamodb_client = boto3.client(
+    'dynamodb',
+    region_name=AWS_REGION,
+    config=Config(
+        max_pool_connections=UPDATE_MAX_CONCURRENCY,
+        retries={'mode': 'standard', 'max_attempts': 1},
+    ),
+)
+bulk_updater = BulkUpdater(
+    dynamodb_client,
+    TABLE_NAME,
+    key_name='chargeback_id',
+    max_concurrency=UPDATE_MAX_CONCURRENCY,
+    initial_concurrency=UPDATE_INITIAL_CONCURRENCY,
+    rate_limit=UPDATE_RATE_LIMIT,
+    max_attempts=UPDATE_MAX_ATTEMPTS,
+    backoff_base_seconds=UPDATE_BACKOFF_BASE_SECONDS,
+    backoff_max_seconds=UPDATE_BACKOFF_MAX_SECONDS,
+)
+serializer = TypeSerializer()
+
+# Conditional updates
+# When true, an item is only written if it has no consolidation yet or an
+# older one (lower consolidation_execution, or the same execution completed
+# earlier). Equal or older events become no-ops: counted as skipped, and no
+# new DynamoDB Stream record is fed back into Kafka.
+CONDITIONAL_UPDATES = os.environ.get('CONDITIONAL_UPDATES', 'true').lower() == 'true'
+CONSOLIDATION_CONDITION = (
+    'attribute_not_exists(consolidation_execution) '
+    'OR consolidation_execution < :execution '
+    'OR (consolidation_execution = :execution AND consolidation_date < :date)'
+)
+
+# Batch coalescing (see message_batch.py)
+# When true, only the latest execution of each partition_date in a batch is
+# processed; earlier executions of the same day are acknowledged with it.
+# When false, only exact repeats of an execution are dropped.
+COALESCE_PARTITION_EVENTS = os.environ.get('COALESCE_PARTITION_EVENTS', 'true').lower() == 'true'
+
+# Checkpointed work units (see checkpoint_store.py)
+# With a checkpoint table, each event is split into work units (one per
+# created-date shard or scan segment) and completed units are recorded, so a
+# retried message resumes where the previous attempt stopped. Empty disables it.
+CHECKPOINT_TABLE_NAME = os.environ.get('CHECKPOINT_TABLE_NAME', '')
+CHECKPOINT_TTL_DAYS = int(os.environ.get('CHECKPOINT_TTL_DAYS', '7'))
+checkpoint_store = (
+    CheckpointStore(dynamodb.Table(CHECKPOINT_TABLE_NAME), CHECKPOINT_TTL_DAYS)
+    if CHECKPOINT_TABLE_NAME else None
+)
+
+# No new work is taken once less than this is left before the Lambda timeout
+TIME_RESERVE_SECONDS = float(os.environ.get('TIME_RESERVE_SECONDS', '10'))
+
+# Work unit fan-out (requires CHECKPOINT_TABLE_NAME)
+# none: this invocation processes the pending units one after another
+# async: each pending unit is sent to an asynchronous invocation of this
+#        function, and this invocation waits on the checkpoint
+FANOUT_MODE = os.environ.get('FANOUT_MODE', 'none').lower()
+FANOUT_POLL_SECONDS = float(os.environ.get('FANOUT_POLL_SECONDS', '5'))
+lambda_client = boto3.client('lambda', region_name=AWS_REGION) if FANOUT_MODE == 'async' else None
+
+
+class EmptyIndexLookupError(Exception):
+    """The created-date index returned no chargebacks for a day with records."""
+
+
+class ConsolidationIncompleteError(Exception):
+    """Work units are left; the message is retried and resumes from the checkpoint."""
 
+
+@instrumentation.handler
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Main Lambda handler for processing MSK Kafka events.
@@ -45,6 +169,10 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     Returns:
         Dict with batchItemFailures for partial batch failure handling
     """
+    # Work unit sent by a fan-out invocation (FANOUT_MODE=async)
+    if 'consolidation_work_unit' in event:
+        return handle_work_unit(event['consolidation_work_unit'], context)
+    
     logger.info(f"Received event from {event.get('eventSource', 'unknown')}")
     logger.debug(f"Full event: {json.dumps(event)}")
     
@@ -54,45 +182,55 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     chargebacks_updated = 0
     
     try:
-        # Parse Kafka messages from MSK event
-        kafka_messages = parse_kafka_messages(event)
-        logger.info(f"Parsed {len(kafka_messages)} Kafka messages")
+        # Decode, validate and coalesce the whole batch before any DynamoDB work
+        with instrumentation.stage('parse'):
+            parsed_messages = parse_batch(event, COALESCE_PARTITION_EVENTS)
+        logger.info(f"Parsed {len(parsed_messages)} Kafka messages")
+        
+        # Superseded messages succeed or fail with the message kept in their place
+        superseded = superseded_messages(parsed_messages)
+        messages_superseded = sum(len(identifiers) for identifiers in superseded.values())
         
         # Process each message
-        for message in kafka_messages:
+        for parsed in parsed_messages:
+            consolidation_event = parsed.event
+            if consolidation_event is None:
+                # Invalid (logged by parse_batch) or superseded by another message
+                continue
+            
             try:
-                # Decode and parse consolidation event
-                consolidation_event = parse_consolidation_event(message)
-                
-                if not consolidation_event:
-                    logger.warning(f"Skipping invalid message at offset {message.get('offset')}")
-                    continue
-                
                 logger.info(f"Processing consolidation event: {consolidation_event.get('partition_date')}")
                 
                 # Update DynamoDB records for this partition
-                updated_count = update_dynamodb_records(consolidation_event)
+                updated_count = update_dynamodb_records(consolidation_event, context)
                 chargebacks_updated += updated_count
                 messages_processed += 1
                 
                 logger.info(f"Updated {updated_count} chargeback records for partition {consolidation_event.get('partition_date')}")
                 
+            except ConsolidationIncompleteError as e:
+                logger.warning(f"Message {parsed.identifier} left incomplete, will resume: {str(e)}")
+                messages_failed += 1
+                
+                for identifier in [parsed.identifier, *superseded.get(parsed.identifier, [])]:
+                    batch_item_failures.append({'itemIdentifier': identifier})
+                
             except Exception as e:
-                logger.error(f"Failed to process message at offset {message.get('offset')}: {str(e)}", exc_info=True)
+                logger.error(f"Failed to process message {parsed.identifier}: {str(e)}", exc_info=True)
                 messages_failed += 1
                 
                 # Add to batch item failures for retry
-                batch_item_failures.append({
-                    'itemIdentifier': f"{message.get('topic')}-{message.get('partition')}-{message.get('offset')}"
-                })
+                for identifier in [parsed.identifier, *superseded.get(parsed.identifier, [])]:
+                    batch_item_failures.append({'itemIdentifier': identifier})
         
         # Log summary metrics
         logger.info(f"METRICS: messages_processed={messages_processed}, "
                    f"messages_failed={messages_failed}, "
+                   f"messages_superseded={messages_superseded}, "
                    f"chargebacks_updated={chargebacks_updated}")
         
         # Publish custom CloudWatch metrics
-        publish_metrics(messages_processed, messages_failed, chargebacks_updated)
+        publish_metrics(messages_processed, messages_failed, chargebacks_updated, messages_superseded)
         
     except Exception as e:
         logger.error(f"Fatal error processing batch: {str(e)}", exc_info=True)
@@ -104,145 +242,623 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     }
 
 
-def parse_kafka_messages(event: Dict[str, Any]) -> List[Dict[str, Any]]:
+def created_date_shard(chargeback_id: str) -> int:
     """
-    Extract Kafka messages from MSK event structure.
+    Shard of a chargeback within its created date.
+    
+    Writers must use the same formula when setting created_date_bucket.
     
     Args:
-        event: MSK Lambda event
+        chargeback_id: DynamoDB partition key
         
     Returns:
-        List of Kafka message dictionaries
+        Shard number in [0, CREATED_DATE_SHARDS)
     """
-    messages = []
-    records = event.get('records', {})
-    
-    # MSK event structure: records is a dict with topic-partition as keys
-    for topic_partition, partition_messages in records.items():
-        for message in partition_messages:
-            messages.append(message)
-    
-    return messages
+    return zlib.crc32(chargeback_id.encode('utf-8')) % CREATED_DATE_SHARDS
 
 
-def parse_consolidation_event(message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+def created_date_bucket(partition_date: str, shard: int) -> str:
     """
-    Parse and validate a consolidation event from Kafka message.
+    Value of the created-date GSI partition key, e.g. '2025-11-20#07'.
     
     Args:
-        message: Kafka message dictionary
+        partition_date: Date in YYYY-MM-DD format
+        shard: Shard number from created_date_shard
         
     Returns:
-        Parsed consolidation event or None if invalid
+        created_date_bucket attribute value
     """
-    try:
-        # Decode base64 value
-        value_bytes = base64.b64decode(message.get('value', ''))
-        value_str = value_bytes.decode('utf-8')
+    return f"{partition_date}#{shard:02d}"
+
+
+def iter_pages(operation, **kwargs) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield every result page of a DynamoDB Query or Scan.
+    
+    Follows LastEvaluatedKey until the result set is exhausted, so nothing is
+    silently dropped past the 1 MB page limit.
+    
+    Args:
+        operation: Bound table.query or table.scan
+        **kwargs: Request parameters
         
-        # Parse JSON
-        event_data = json.loads(value_str)
+    Yields:
+        Items of one page
+    """
+    while True:
+        started = time.perf_counter()
+        response = operation(**kwargs)
+        instrumentation.add_time('dynamodb_lookup', time.perf_counter() - started)
         
-        # Validate required fields
-        required_fields = [
-            'event_type',
-            'partition_date',
-            'execution_sequence',
-            'total_executions',
-            'records_processed',
-            'output_files',
-            'output_format',
-            'output_path',
-            'completed_at',
-            'job_name'
-        ]
+        yield response.get('Items', [])
+        
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+
+def iter_query_pages(partition_date: str) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield the chargebacks created on a date through the created-date GSI.
+    
+    Issues one paginated Query per shard; the index is KEYS_ONLY, so each
+    page only carries chargeback_id values.
+    
+    Args:
+        partition_date: Date in YYYY-MM-DD format
         
-        for field in required_fields:
-            if field not in event_data:
-                logger.warning(f"Missing required field: {field}")
-                return None
+    Yields:
+        Items (with chargeback_id) of one page
+    """
+    for shard in range(CREATED_DATE_SHARDS):
+        yield from iter_shard_pages(partition_date, shard)
+
+
+def iter_shard_pages(partition_date: str, shard: int) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield the chargebacks of one created-date shard.
+    
+    Args:
+        partition_date: Date in YYYY-MM-DD format
+        shard: Shard number from created_date_shard
         
-        # Validate event type
-        if event_data['event_type'] != 'consolidation_completed':
-            logger.warning(f"Unknown event type: {event_data['event_type']}")
-            return None
+    Yields:
+        Items (with chargeback_id) of one page
+    """
+    yield from iter_pages(
+        table.query,
+        IndexName=CREATED_DATE_INDEX_NAME,
+        KeyConditionExpression=Key('created_date_bucket').eq(created_date_bucket(partition_date, shard)),
+        ProjectionExpression='chargeback_id',
+    )
+
+
+def scan_filter(partition_date: str) -> Dict[str, Any]:
+    """Scan parameters selecting the chargebacks created on a date."""
+    return {
+        'FilterExpression': 'begins_with(created_at, :date)',
+        'ExpressionAttributeValues': {':date': partition_date},
+        'ProjectionExpression': 'chargeback_id',
+    }
+
+
+def iter_scan_pages(partition_date: str, total_segments: int = 1) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield the chargebacks created on a date with a filtered table Scan.
+    
+    With total_segments > 1 the segments are scanned by parallel threads
+    (each with its own boto3 session, as resources are not thread-safe) that
+    hand pages over through a queue of at most SCAN_MAX_BUFFERED_PAGES, so
+    memory stays bounded however large the table is.
+    
+    Args:
+        partition_date: Date in YYYY-MM-DD format
+        total_segments: Number of parallel scan segments
         
-        return event_data
+    Yields:
+        Items (with chargeback_id) of one page
+    """
+    scan_kwargs = scan_filter(partition_date)
+    
+    if total_segments <= 1:
+        yield from iter_pages(table.scan, **scan_kwargs)
+        return
+    
+    pages = queue.Queue(maxsize=SCAN_MAX_BUFFERED_PAGES)
+    stop = threading.Event()
+    done = object()
+    
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def scan_segment(segment: int) -> None:
+        try:
+            segment_table = boto3.session.Session().resource('dynamodb', region_name=AWS_REGION).Table(TABLE_NAME)
+            for page in iter_pages(segment_table.scan, Segment=segment, TotalSegments=total_segments, **scan_kwargs):
+                if not put(page):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+    
+    workers = [
+        threading.Thread(target=scan_segment, args=(segment,), name=f'scan-segment-{segment}', daemon=True)
+        for segment in range(total_segments)
+    ]
+    for worker in workers:
+        worker.start()
+    
+    try:
+        finished = 0
+        while finished < total_segments:
+            item = pages.get()
+            if item is done:
+                finished += 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        # Release any segment thread blocked on a full queue
+        stop.set()
+
+
+def check_lookup_found(consolidation_event: Dict[str, Any], found_count: int) -> None:
+    """
+    Fail an event whose index lookup found nothing although the day has records.
+    
+    An empty created-date index almost always means the items do not carry
+    created_date_bucket, so silently updating zero chargebacks would hide it.
+    
+    Raises:
+        EmptyIndexLookupError: query mode, nothing found, records_processed > 0
+    """
+    if PARTITION_LOOKUP_MODE != 'query' or found_count > 0:
+        return
+    if consolidation_event['records_processed'] > 0:
+        raise EmptyIndexLookupError(
+            f"Query on {CREATED_DATE_INDEX_NAME} found no chargebacks for "
+            f"{consolidation_event['partition_date']} although the consolidation processed "
+            f"{consolidation_event['records_processed']} records; check that items carry "
+            f"created_date_bucket or use PARTITION_LOOKUP_MODE=scan"
+        )
+
+
+def iter_partition_chargebacks(partition_date: str) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the chargebacks of a partition date, page by page.
+    
+    Uses the created-date GSI (PARTITION_LOOKUP_MODE=query) or the segmented
+    scan fallback.
+    
+    Args:
+        partition_date: Date in YYYY-MM-DD format
         
-    except (ValueError, json.JSONDecodeError) as e:
-        logger.error(f"Failed to parse message value: {str(e)}")
-        return None
-    except Exception as e:
-        logger.error(f"Unexpected error parsing message: {str(e)}", exc_info=True)
-        return None
+    Yields:
+        Items with chargeback_id
+    """
+    if PARTITION_LOOKUP_MODE == 'query':
+        pages = iter_query_pages(partition_date)
+    else:
+        pages = iter_scan_pages(partition_date, SCAN_TOTAL_SEGMENTS)
+    
+    for page in pages:
+        yield from page
 
 
-def update_dynamodb_records(consolidation_event: Dict[str, Any]) -> int:
+def update_dynamodb_records(consolidation_event: Dict[str, Any], context: Any = None) -> int:
     """
     Update DynamoDB chargeback records with consolidation metadata.
     
-    This function queries DynamoDB to find all chargebacks for the given partition date
-    and updates them with consolidation information.
+    This function streams all chargebacks for the given partition date (every
+    result page, not just the first) into the bulk update engine, which
+    updates them concurrently as they arrive. With PARTITION_LOOKUP_MODE=query
+    the lookup goes through the created-date GSI; scan is kept for tables
+    without the index.
+    
+    With CHECKPOINT_TABLE_NAME set, the work is split into checkpointed work
+    units instead (see update_work_units).
     
     Args:
         consolidation_event: Parsed consolidation event
+        context: Lambda context, used for the remaining time
         
     Returns:
         Number of records updated
+        
+    Raises:
+        ConsolidationIncompleteError: Work units are left for a retry
+        EmptyIndexLookupError: The created-date index had nothing for the day
     """
+    if checkpoint_store is not None:
+        return update_work_units(consolidation_event, context)
+    
     partition_date = consolidation_event['partition_date']
-    updated_count = 0
     
     try:
-        # Query chargebacks by partition date
-        # Note: This assumes chargebacks have a 'created_at' field in YYYY-MM-DD format
-        # Adjust the query based on your actual DynamoDB schema
-        
-        # Option 1: Scan with filter (for POC - not recommended for production)
-        response = table.scan(
-            FilterExpression='begins_with(created_at, :date)',
-            ExpressionAttributeValues={
-                ':date': partition_date
-            }
+        result, found_count = apply_consolidation_update(
+            consolidation_event,
+            iter_partition_chargebacks(partition_date),
+            f"partition date {partition_date}",
         )
         
-        chargebacks = response.get('Items', [])
-        logger.info(f"Found {len(chargebacks)} chargebacks for partition date {partition_date}")
+        check_lookup_found(consolidation_event, found_count)
+        
+        return result.succeeded
+        
+    except ClientError as e:
+        logger.error(f"DynamoDB query failed: {str(e)}", exc_info=True)
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error updating records: {str(e)}", exc_info=True)
+        raise
+
+
+def apply_consolidation_update(
+    consolidation_event: Dict[str, Any],
+    chargebacks: Iterable[Dict[str, Any]],
+    label: str,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> Tuple[BulkUpdateResult, int]:
+    """
+    Run the bulk update engine over a stream of chargebacks and log the outcome.
+    
+    Args:
+        consolidation_event: Parsed consolidation event
+        chargebacks: Items with chargeback_id (may be lazy)
+        label: What is being updated, for the logs
+        should_stop: Passed to BulkUpdater.run
         
-        # Update each chargeback
+    Returns:
+        (BulkUpdateResult, number of chargebacks found)
+    """
+    counts = {'found': 0}
+    
+    def chargeback_ids() -> Iterator[str]:
         for chargeback in chargebacks:
+            counts['found'] += 1
             chargeback_id = chargeback.get('chargeback_id')
             
             if not chargeback_id:
                 logger.warning(f"Chargeback missing chargeback_id: {chargeback}")
                 continue
             
-            try:
-                update_chargeback(chargeback_id, consolidation_event)
-                updated_count += 1
-                
-            except ClientError as e:
-                logger.error(f"Failed to update chargeback {chargeback_id}: {str(e)}")
-                # Continue processing other records
-                continue
+            yield chargeback_id
+    
+    update_expression, expression_values = build_consolidation_update(consolidation_event)
+    # Wall time of the update run; it includes the lookups it consumes
+    with instrumentation.stage('dynamodb_update'):
+        result = bulk_updater.run(
+            chargeback_ids(),
+            update_expression,
+            expression_values,
+            condition_expression=CONSOLIDATION_CONDITION if CONDITIONAL_UPDATES else None,
+            should_stop=should_stop,
+        )
+    instrumentation.count('chargebacks_found', counts['found'])
+    instrumentation.count('update_attempts', result.attempts)
+    instrumentation.count('updates_throttled', result.throttled)
+    
+    logger.info(f"Found {counts['found']} chargebacks for {label}")
+    
+    if result.skipped:
+        logger.info(f"Skipped {result.skipped} chargebacks already at this or a newer consolidation")
+    
+    # Exact per-item outcome; failed items are logged and skipped as before
+    for chargeback_id, error in result.failed:
+        logger.error(f"Failed to update chargeback {chargeback_id}: {error}")
+    
+    logger.info(
+        f"METRICS: partition_date={consolidation_event['partition_date']}, "
+        + ", ".join(f"{name}={value}" for name, value in result.stats().items())
+    )
+    
+    dimensions = {
+        'partition_date': consolidation_event['partition_date'],
+        'execution_sequence': consolidation_event['execution_sequence'],
+    }
+    metrics.increment('ChargebacksUpdated', result.succeeded, dimensions=dimensions)
+    metrics.increment('ChargebacksSkipped', result.skipped, dimensions=dimensions)
+    metrics.increment('ChargebacksFailed', result.failed_count, dimensions=dimensions)
+    metrics.increment('UpdatesThrottled', result.throttled, dimensions=dimensions)
+    for latency, count in result.latency_ms.items():
+        metrics.record('ChargebackUpdateLatency', latency, dimensions=dimensions, count=count)
+    
+    return result, counts['found']
+
+
+def out_of_time(context: Any, margin_seconds: float = 0) -> bool:
+    """True when less than TIME_RESERVE_SECONDS (+ margin) is left in the invocation."""
+    if context is None:
+        return False
+    return context.get_remaining_time_in_millis() < (TIME_RESERVE_SECONDS + margin_seconds) * 1000
+
+
+def plan_work_units() -> List[Dict[str, Any]]:
+    """
+    Split a partition into work units.
+    
+    One unit per created-date shard in query mode, one per scan segment in
+    scan mode. Unit ids encode the split, so changing CREATED_DATE_SHARDS or
+    SCAN_TOTAL_SEGMENTS between retries only causes already-updated items
+    to be updated again (updates are idempotent).
+    
+    Returns:
+        List of work units ({'id': ..., 'shard': ...} or
+        {'id': ..., 'segment': ..., 'total_segments': ...})
+    """
+    if PARTITION_LOOKUP_MODE == 'query':
+        return [
+            {'id': f"shard-{shard:02d}-of-{CREATED_DATE_SHARDS}", 'shard': shard}
+            for shard in range(CREATED_DATE_SHARDS)
+        ]
+    
+    total_segments = max(1, SCAN_TOTAL_SEGMENTS)
+    return [
+        {'id': f"segment-{segment}-of-{total_segments}", 'segment': segment, 'total_segments': total_segments}
+        for segment in range(total_segments)
+    ]
+
+
+def iter_unit_chargebacks(partition_date: str, unit: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the chargebacks of one work unit, page by page.
+    
+    Args:
+        partition_date: Date in YYYY-MM-DD format
+        unit: Work unit from plan_work_units
+        
+    Yields:
+        Items with chargeback_id
+    """
+    if 'shard' in unit:
+        pages = iter_shard_pages(partition_date, unit['shard'])
+    else:
+        pages = iter_pages(
+            table.scan,
+            Segment=unit['segment'],
+            TotalSegments=unit['total_segments'],
+            **scan_filter(partition_date),
+        )
+    
+    for page in pages:
+        yield from page
+
+
+def update_work_units(consolidation_event: Dict[str, Any], context: Any) -> int:
+    """
+    Update a partition as checkpointed work units, resuming a previous attempt.
+    
+    Units already recorded on the checkpoint are skipped. The pending ones are
+    processed here one after another, or fanned out to asynchronous
+    invocations (FANOUT_MODE=async). If time runs out first, the completed
+    units stay recorded and ConsolidationIncompleteError makes the message
+    retry only what is left.
+    
+    Args:
+        consolidation_event: Parsed consolidation event
+        context: Lambda context
         
-        return updated_count
+    Returns:
+        Number of records updated by this invocation
         
-    except ClientError as e:
-        logger.error(f"DynamoDB query failed: {str(e)}", exc_info=True)
-        raise
-    except Exception as e:
-        logger.error(f"Unexpected error updating records: {str(e)}", exc_info=True)
-        raise
+    Raises:
+        ConsolidationIncompleteError: Work units are left for a retry
+        EmptyIndexLookupError: No unit found any chargeback (query mode)
+    """
+    checkpoint_id = checkpoint_id_for(consolidation_event)
+    units = plan_work_units()
+    with instrumentation.stage('checkpoint'):
+        completed = checkpoint_store.completed_units(checkpoint_id)
+    pending = [unit for unit in units if unit['id'] not in completed]
+    
+    if not pending:
+        logger.info(f"Checkpoint {checkpoint_id}: all {len(units)} work units already completed")
+        check_work_units_found(consolidation_event, checkpoint_id)
+        return 0
+    
+    logger.info(f"Checkpoint {checkpoint_id}: {len(pending)} of {len(units)} work units pending")
+    
+    if FANOUT_MODE == 'async' and context is not None:
+        with instrumentation.stage('fanout_dispatch'):
+            dispatch_work_units(consolidation_event, pending, len(units), context)
+        with instrumentation.stage('fanout_wait'):
+            wait_for_work_units(checkpoint_id, units, context)
+        check_work_units_found(consolidation_event, checkpoint_id)
+        return 0
+    
+    updated_count = 0
+    for index, unit in enumerate(pending):
+        if out_of_time(context):
+            raise ConsolidationIncompleteError(
+                f"{checkpoint_id}: out of time with {len(pending) - index} work units left "
+                f"({updated_count} chargebacks updated in this attempt)"
+            )
+        
+        updated_count += process_work_unit(consolidation_event, unit, len(units), context)
+    
+    check_work_units_found(consolidation_event, checkpoint_id)
+    return updated_count
 
 
-def update_chargeback(chargeback_id: str, consolidation_event: Dict[str, Any]) -> None:
+def check_work_units_found(consolidation_event: Dict[str, Any], checkpoint_id: str) -> None:
+    """
+    Apply check_lookup_found to the chargebacks found by all work units.
+    
+    A single shard may legitimately be empty, so the check runs on the
+    checkpoint total once every unit is recorded. Recorded units are not
+    redone, so a retried message fails here again instead of passing as
+    done with zero updates.
+    
+    Raises:
+        EmptyIndexLookupError: See check_lookup_found
     """
-    Update a single chargeback record with consolidation metadata.
+    if PARTITION_LOOKUP_MODE != 'query':
+        return
+    
+    with instrumentation.stage('checkpoint'):
+        found_count = checkpoint_store.chargebacks_found(checkpoint_id)
+    # Checkpoints written before chargebacks_found was recorded carry no total
+    if found_count is not None:
+        check_lookup_found(consolidation_event, found_count)
+
+
+def process_work_unit(
+    consolidation_event: Dict[str, Any],
+    unit: Dict[str, Any],
+    total_units: int,
+    context: Any,
+) -> int:
+    """
+    Update the chargebacks of one work unit and record it on the checkpoint.
+    
+    A unit cut short by the time reserve is not recorded, so it is redone
+    in full on retry.
+    
+    Args:
+        consolidation_event: Parsed consolidation event
+        unit: Work unit from plan_work_units
+        total_units: Number of units of the event
+        context: Lambda context
+        
+    Returns:
+        Number of records updated
+        
+    Raises:
+        ConsolidationIncompleteError: The time reserve was reached mid-unit
+    """
+    partition_date = consolidation_event['partition_date']
+    result, found_count = apply_consolidation_update(
+        consolidation_event,
+        iter_unit_chargebacks(partition_date, unit),
+        f"partition date {partition_date}, work unit {unit['id']}",
+        should_stop=lambda: out_of_time(context),
+    )
+    
+    if result.stopped:
+        raise ConsolidationIncompleteError(
+            f"Out of time in work unit {unit['id']} after {result.succeeded} updates"
+        )
+    
+    with instrumentation.stage('checkpoint'):
+        checkpoint_store.complete_unit(
+            checkpoint_id_for(consolidation_event),
+            unit['id'],
+            total_units,
+            found_count,
+            result.succeeded,
+            result.skipped,
+            result.failed_count,
+        )
+    return result.succeeded
+
+
+def dispatch_work_units(
+    consolidation_event: Dict[str, Any],
+    units: List[Dict[str, Any]],
+    total_units: int,
+    context: Any,
+) -> None:
+    """
+    Send each work unit to an asynchronous invocation of this function.
+    
+    The event travels as a JSON string encoded with simplejson (see
+    requirements.txt), so Decimal values survive the Lambda payload round
+    trip exactly.
+    """
+    encoded_event = encode_json(consolidation_event).decode('utf-8')
+    
+    for unit in units:
+        lambda_client.invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps({
+                'consolidation_work_unit': {
+                    'event': encoded_event,
+                    'unit': unit,
+                    'total_units': total_units,
+                }
+            }),
+        )
+    
+    logger.info(f"Dispatched {len(units)} work units to {context.invoked_function_arn}")
+
+
+def wait_for_work_units(checkpoint_id: str, units: List[Dict[str, Any]], context: Any) -> None:
+    """
+    Poll the checkpoint until every work unit is recorded.
+    
+    Raises:
+        ConsolidationIncompleteError: Units are still missing when the time
+            reserve is reached; the retry re-dispatches only those
+    """
+    unit_ids = {unit['id'] for unit in units}
+    
+    while True:
+        missing = unit_ids - checkpoint_store.completed_units(checkpoint_id)
+        if not missing:
+            logger.info(f"Checkpoint {checkpoint_id}: all {len(unit_ids)} work units completed")
+            return
+        
+        if out_of_time(context, FANOUT_POLL_SECONDS):
+            raise ConsolidationIncompleteError(
+                f"{checkpoint_id}: {len(missing)} work units still running at the time reserve"
+            )
+        
+        time.sleep(FANOUT_POLL_SECONDS)
+
+
+def handle_work_unit(work_unit: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Entry point of a fan-out invocation: process and record one work unit.
+    
+    Errors propagate so Lambda's asynchronous retries apply; the coordinating
+    invocation re-dispatches units that never get recorded.
+    
+    Args:
+        work_unit: Payload built by dispatch_work_units
+        context: Lambda context
+        
+    Returns:
+        Summary of the unit
+    """
+    consolidation_event = decode_json(work_unit['event'].encode('utf-8'))
+    unit = work_unit['unit']
+    
+    # A unit re-dispatched by a retried message may already be done
+    if unit['id'] in checkpoint_store.completed_units(checkpoint_id_for(consolidation_event)):
+        logger.info(f"Work unit {unit['id']} already completed")
+        return {'unit': unit['id'], 'chargebacks_updated': 0}
+    
+    try:
+        updated_count = process_work_unit(consolidation_event, unit, work_unit['total_units'], context)
+    finally:
+        with instrumentation.stage('metrics_flush'):
+            metrics.flush()
+    
+    return {'unit': unit['id'], 'chargebacks_updated': updated_count}
+
+
+def build_consolidation_update(consolidation_event: Dict[str, Any]) -> Tuple[str, Dict[str, Dict[str, Any]]]:
+    """
+    Build the UpdateItem expression shared by every chargeback of an event.
+    
+    Values are serialized to DynamoDB's typed form once, for the low-level
+    client used by the bulk update engine.
     
     Args:
-        chargeback_id: DynamoDB partition key
         consolidation_event: Consolidation event data
+        
+    Returns:
+        (UpdateExpression, typed ExpressionAttributeValues)
     """
     update_expression = (
         'SET consolidation_status = :status, '
@@ -266,59 +882,30 @@ def update_chargeback(chargeback_id: str, consolidation_event: Dict[str, Any]) -
         ':updated': datetime.utcnow().isoformat() + 'Z'
     }
     
-    table.update_item(
-        Key={'chargeback_id': chargeback_id},
-        UpdateExpression=update_expression,
-        ExpressionAttributeValues=expression_values,
-        ReturnValues='NONE'
-    )
-    
-    logger.debug(f"Updated chargeback {chargeback_id} with consolidation metadata")
+    return update_expression, {
+        name: serializer.serialize(value) for name, value in expression_values.items()
+    }
 
 
-def publish_metrics(processed: int, failed: int, updated: int) -> None:
+def publish_metrics(processed: int, failed: int, updated: int, superseded: int = 0) -> None:
     """
     Publish custom CloudWatch metrics.
     
+    Adds the invocation totals to the metrics buffered while processing
+    (per-partition counts and update latencies) and writes them all at once,
+    as EMF log lines or a single put_metric_data call (METRICS_MODE).
+    
     Args:
         processed: Number of messages successfully processed
         failed: Number of messages that failed
         updated: Number of chargebacks updated
+        superseded: Number of messages coalesced into a later event
     """
-    try:
-        namespace = 'POC-Chargeback/ConsolidationUpdater'
-        
-        metrics = [
-            {
-                'MetricName': 'MessagesProcessed',
-                'Value': processed,
-                'Unit': 'Count'
-            },
-            {
-                'MetricName': 'MessagesFailed',
-                'Value': failed,
-                'Unit': 'Count'
-            },
-            {
-                'MetricName': 'ChargebacksUpdated',
-                'Value': updated,
-                'Unit': 'Count'
-            }
-        ]
-        
-        for metric in metrics:
-            cloudwatch.put_metric_data(
-                Namespace=namespace,
-                MetricData=[{
-                    'MetricName': metric['MetricName'],
-                    'Value': metric['Value'],
-                    'Unit': metric['Unit'],
-                    'Timestamp': datetime.utcnow()
-                }]
-            )
-        
-        logger.debug(f"Published {len(metrics)} CloudWatch metrics")
-        
-    except Exception as e:
-        # Don't fail the function if metrics publishing fails
-        logger.warning(f"Failed to publish CloudWatch metrics: {str(e)}")
+    metrics.increment('MessagesProcessed', processed)
+    metrics.increment('MessagesFailed', failed)
+    metrics.increment('MessagesSuperseded', superseded)
+    metrics.increment('ChargebacksUpdated', updated)
+    
+    with instrumentation.stage('metrics_flush'):
+        written = metrics.flush()
+    logger.debug(f"Flushed CloudWatch metrics ({METRICS_MODE}, {written} writes)")
@@ -0,0 +1,270 @@
+"""
+Event Codec - Kafka payload serialization shared by the Lambda functions
+========================================================================
+
+Serializers for the events the stream processor publishes to Kafka, and a
+decoder that accepts every supported wire format so consumers (e.g. the
+consolidation updater) do not need to know which one a producer used.
+
+Wire formats:
+    json     UTF-8 JSON (default, what the Flink job reads today)
+    msgpack  5-byte header (magic byte 0x00 + big-endian schema id) followed
+             by a MessagePack array. The data/old_data images are written as
+             positional rows in the schema's field order, so attribute names
+             are not repeated in every message.
+
+This module is copied into each Lambda deployment package by build.sh.
+
+Author: POC Chargeback Team
+"""
+
+import json
+import struct
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    # simplejson writes Decimal as an exact JSON number
+    import simplejson
+except ImportError:  # pragma: no cover - both Lambdas install it; other users may not
+    simplejson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - only needed for the msgpack format
+    msgpack = None
+
+try:
+    # orjson parses JSON several times faster than the stdlib module
+    import orjson
+except ImportError:  # pragma: no cover - optional speed-up for consumers
+    orjson = None
+
+
+MAGIC_BYTE = 0
+HEADER = struct.Struct('>bI')
+
+# MessagePack extension type used for exact Decimal values
+DECIMAL_EXT_TYPE = 1
+
+# Field order of the chargeback image, per schema id. Schemas are append-only:
+# a new attribute gets a new schema id so old payloads stay decodable.
+SCHEMAS = {
+    1: (
+        'chargeback_id',
+        'merchant_id',
+        'transaction_id',
+        'amount',
+        'currency',
+        'status',
+        'reason',
+        'created_at',
+        'updated_at',
+        'consolidation_status',
+        'consolidation_s3_path',
+        'consolidation_date',
+        'consolidation_execution',
+        'consolidation_job_name',
+        'output_format',
+        'records_in_consolidation',
+    ),
+}
+CURRENT_SCHEMA_ID = 1
+
+# Top-level event fields stored positionally in the envelope
+ENVELOPE_FIELDS = ('event_type', 'event_timestamp', 'table_name', 'event_id')
+
+
+# =============================================================================
+# JSON
+# =============================================================================
+
+def _json_default(value: Any) -> Any:
+    """Fallback encoding for Decimal when simplejson is not available."""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_json(event: Dict) -> bytes:
+    """
+    Serialize an event to compact UTF-8 JSON.
+    
+    Decimal values are written as exact JSON numbers by simplejson; the
+    stdlib fallback converts them to int/float.
+    """
+    if simplejson is not None:
+        return simplejson.dumps(event, use_decimal=True, separators=(',', ':')).encode('utf-8')
+    return json.dumps(event, default=_json_default, separators=(',', ':')).encode('utf-8')
+
+
+def decode_json(payload: bytes) -> Dict:
+    """Parse a UTF-8 JSON payload, keeping non-integer numbers as Decimal."""
+    return json.loads(payload, parse_float=Decimal)
+
+
+def decode_json_fast(payload: bytes) -> Dict:
+    """
+    Parse a UTF-8 JSON payload with orjson when it is installed.
+    
+    Non-integer numbers come back as float; use decode_json where exact
+    values matter.
+    """
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+# =============================================================================
+# MESSAGEPACK WITH SCHEMA ID
+# =============================================================================
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return msgpack.ExtType(DECIMAL_EXT_TYPE, str(value).encode('ascii'))
+    raise TypeError(f"Object of type {type(value).__name__} is not MessagePack serializable")
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> Any:
+    if code == DECIMAL_EXT_TYPE:
+        return Decimal(data.decode('ascii'))
+    return msgpack.ExtType(code, data)
+
+
+def _encode_row(image: Optional[Dict], fields: tuple) -> Optional[List]:
+    """
+    Encode an image as [presence_mask, value..., extras].
+    
+    Bit i of presence_mask is set when fields[i] is present; only present
+    values follow, in field order. Attributes outside the schema go into the
+    trailing extras map (None when there are none).
+    """
+    if image is None:
+        return None
+    
+    mask = 0
+    row = [0]
+    for index, name in enumerate(fields):
+        if name in image:
+            mask |= 1 << index
+            row.append(image[name])
+    row[0] = mask
+    
+    if len(row) - 1 < len(image):
+        known = set(fields)
+        row.append({name: value for name, value in image.items() if name not in known})
+    else:
+        row.append(None)
+    
+    return row
+
+
+def _decode_row(row: Optional[List], fields: tuple) -> Optional[Dict]:
+    if row is None:
+        return None
+    
+    mask = row[0]
+    image = {}
+    position = 1
+    for index, name in enumerate(fields):
+        if mask & (1 << index):
+            image[name] = row[position]
+            position += 1
+    
+    extras = row[position]
+    if extras:
+        image.update(extras)
+    
+    return image
+
+
+def encode_msgpack(event: Dict, schema_id: int = CURRENT_SCHEMA_ID) -> bytes:
+    """
+    Serialize an event as schema-framed MessagePack.
+    
+    Envelope: [event_type, event_timestamp, table_name, event_id,
+    data_row, old_data_row, rest] where rest holds any other top-level keys.
+    """
+    if msgpack is None:
+        raise ImportError("msgpack is required for the msgpack event serializer")
+    
+    fields = SCHEMAS[schema_id]
+    envelope = [event.get(name) for name in ENVELOPE_FIELDS]
+    envelope.append(_encode_row(event.get('data'), fields))
+    envelope.append(_encode_row(event.get('old_data'), fields))
+    
+    rest = {
+        name: value for name, value in event.items()
+        if name not in ENVELOPE_FIELDS and name not in ('data', 'old_data')
+    }
+    envelope.append(rest or None)
+    
+    return HEADER.pack(MAGIC_BYTE, schema_id) + msgpack.packb(
+        envelope, default=_msgpack_default, use_bin_type=True
+    )
+
+
+def decode_msgpack(payload: bytes) -> Dict:
+    """Parse a schema-framed MessagePack payload back into an event dict."""
+    if msgpack is None:
+        raise ImportError("msgpack is required to decode msgpack events")
+    
+    magic, schema_id = HEADER.unpack_from(payload)
+    if magic != MAGIC_BYTE:
+        raise ValueError(f"Unknown magic byte: {magic}")
+    
+    fields = SCHEMAS.get(schema_id)
+    if fields is None:
+        raise ValueError(f"Unknown event schema id: {schema_id}")
+    
+    envelope = msgpack.unpackb(payload[HEADER.size:], ext_hook=_msgpack_ext_hook, raw=False)
+    
+    event = dict(zip(ENVELOPE_FIELDS, envelope))
+    event['data'] = _decode_row(envelope[4], fields)
+    event['old_data'] = _decode_row(envelope[5], fields)
+    if envelope[6]:
+        event.update(envelope[6])
+    
+    return event
+
+
+# =============================================================================
+# REGISTRY
+# =============================================================================
+
+SERIALIZERS = {
+    'json': encode_json,
+    'msgpack': encode_msgpack,
+}
+
+
+def get_serializer(name: str) -> Callable[[Dict], bytes]:
+    """
+    Look up an event serializer by name.
+    
+    Args:
+        name: Serializer name (json, msgpack)
+        
+    Returns:
+        Callable turning an event dict into bytes
+    """
+    serializer = SERIALIZERS.get(name.lower())
+    if serializer is None:
+        raise ValueError(f"Unsupported event serializer: {name} (expected one of {sorted(SERIALIZERS)})")
+    if serializer is encode_msgpack and msgpack is None:
+        raise ImportError("msgpack is required for the msgpack event serializer")
+    return serializer
+
+
+def decode_event(payload: bytes, fast: bool = False) -> Dict:
+    """
+    Decode a Kafka payload written by any supported serializer.
+    
+    Framed MessagePack starts with the 0x00 magic byte; anything else is
+    treated as UTF-8 JSON, parsed by decode_json_fast when fast=True.
+    """
+    if payload[:1] == b'\x00':
+        return decode_msgpack(payload)
+    if fast:
+        return decode_json_fast(payload)
+    return decode_json(payload)
@@ -0,0 +1,143 @@
+"""
+Instrumentation - per-stage latency breakdown for the Lambda handlers
+=====================================================================
+
+A lightweight, dependency-free layer that records where an invocation spends
+its time:
+
+    @instrumentation.handler          wraps lambda_handler, starts a new
+                                      breakdown per invocation and logs it
+    with instrumentation.stage(name)  times a block (thread-safe)
+    instrumentation.add_time(...)     adds a duration measured by the caller,
+                                      e.g. accumulated over a per-record loop
+    instrumentation.count(...)        adds to a per-invocation counter
+
+At the end of each sampled invocation one log line is written:
+
+    TIMINGS: total_ms=812.4, transform_ms=35.1 (500), kafka_ack_ms=701.9 (1), ...
+
+where the number in parentheses is how many times the stage ran. Stages can
+overlap (e.g. lookups that run while updates are in flight), so they do not
+necessarily add up to total_ms.
+
+Only a sample_rate fraction of invocations is instrumented; the others pay a
+single flag check per stage. With otel=True and the opentelemetry API
+installed, each stage is also exported as a span under a per-invocation root
+span; without the package the flag is ignored.
+
+This module is copied into each Lambda deployment package by build.sh.
+
+Author: POC Chargeback Team
+"""
+
+import functools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+def _load_tracer(service: str):
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        logger.warning("OpenTelemetry tracing requested but opentelemetry is not installed; spans disabled")
+        return None
+    return trace.get_tracer(service)
+
+
+class Instrumentation:
+    """Stage timers and counters for one Lambda function."""
+
+    def __init__(self, service: str, sample_rate: float = 1.0, otel: bool = False):
+        """
+        Args:
+            service: Name used for the tracer and the root span
+            sample_rate: Fraction of invocations to instrument (0 disables)
+            otel: Export stages as OpenTelemetry spans
+        """
+        self.service = service
+        self.sample_rate = sample_rate
+        self._tracer = _load_tracer(service) if otel else None
+        self._lock = threading.Lock()
+        self.active = False
+        self._stages: Dict[str, list] = {}
+        self._counters: Dict[str, float] = {}
+
+    def handler(self, func: Callable) -> Callable:
+        """Decorator for lambda_handler."""
+        @functools.wraps(func)
+        def wrapper(event: Any, context: Any) -> Any:
+            self._stages, self._counters = {}, {}
+            self.active = self.sample_rate >= 1 or random.random() < self.sample_rate
+            if not self.active:
+                return func(event, context)
+
+            started = time.perf_counter()
+            try:
+                with self._span(f"{self.service}.invocation", context):
+                    return func(event, context)
+            finally:
+                self._log_breakdown((time.perf_counter() - started) * 1000)
+                self.active = False
+
+        return wrapper
+
+    @contextmanager
+    def stage(self, name: str, span: bool = True) -> Iterator[None]:
+        """Time a block as stage `name` (and a span when tracing)."""
+        if not self.active:
+            yield
+            return
+
+        started = time.perf_counter()
+        try:
+            with (self._span(name) if span else nullcontext()):
+                yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def add_time(self, name: str, seconds: float, calls: int = 1) -> None:
+        """Add a duration measured by the caller to stage `name`."""
+        if not self.active:
+            return
+        with self._lock:
+            totals = self._stages.setdefault(name, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += calls
+
+    def count(self, name: str, value: float = 1) -> None:
+        """Add to a per-invocation counter."""
+        if not self.active:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def breakdown(self) -> Dict[str, Any]:
+        """Stage totals ({'<stage>_ms': ms, '<stage>_calls': n}) and counters so far."""
+        with self._lock:
+            result = {}
+            for name, (seconds, calls) in self._stages.items():
+                result[f"{name}_ms"] = round(seconds * 1000, 1)
+                result[f"{name}_calls"] = calls
+            result.update(self._counters)
+            return result
+
+    def _span(self, name: str, context: Any = None):
+        if self._tracer is None:
+            return nullcontext()
+        attributes = {'faas.invocation_id': getattr(context, 'aws_request_id', '')} if context is not None else None
+        return self._tracer.start_as_current_span(name, attributes=attributes)
+
+    def _log_breakdown(self, total_ms: float) -> None:
+        with self._lock:
+            stages = sorted(self._stages.items(), key=lambda item: -item[1][0])
+            parts = [f"total_ms={total_ms:.1f}"]
+            parts.extend(f"{name}_ms={seconds * 1000:.1f} ({calls})" for name, (seconds, calls) in stages)
+            parts.extend(f"{name}={value}" for name, value in self._counters.items())
+
+        logger.info("TIMINGS: " + ", ".join(parts))
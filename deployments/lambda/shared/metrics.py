@@ -0,0 +1,264 @@
+"""
+Metrics - buffered CloudWatch metrics shared by the Lambda functions
+====================================================================
+
+Metrics are collected in memory during an invocation and written once, at
+flush(), in one of these ways:
+
+    emf  CloudWatch Embedded Metric Format: JSON log lines on stdout that
+         CloudWatch Logs turns into metrics. No API call, no extra latency,
+         no cloudwatch:PutMetricData permission needed (default).
+    api  put_metric_data, batched into as few calls as possible.
+    off  Nothing is written.
+
+Two kinds of metrics:
+
+    increment()  Counters, summed into one value per flush.
+    record()     Distributions (e.g. latencies), kept as a histogram of
+                 values rounded to HISTOGRAM_SIGNIFICANT_DIGITS and written
+                 at 1-second (high) resolution by default, so CloudWatch
+                 can compute percentiles.
+
+Histograms are written as distinct values with their counts, never one
+entry per sample. That keeps the output proportional to the number of
+distinct rounded values, whatever the sample count. In EMF each value is
+an object {"Values", "Counts", "Min", "Max", "Count", "Sum"}; in api mode
+the data points use Values/Counts.
+
+Every metric can carry dimensions on top of the buffer's default ones;
+metrics are grouped by dimension set when written.
+
+This module is copied into each Lambda deployment package by build.sh.
+
+Author: POC Chargeback Team
+"""
+
+import json
+import logging
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Histogram values are rounded to this many significant digits, which bounds
+# the number of distinct values per flush
+HISTOGRAM_SIGNIFICANT_DIGITS = 3
+
+# CloudWatch limits
+EMF_MAX_VALUES_PER_METRIC = 100
+API_MAX_VALUES_PER_DATUM = 150
+API_MAX_DATA_PER_CALL = 1000
+
+
+def _write_stdout(line: str) -> None:
+    # Lambda ships each stdout line to CloudWatch Logs as one log event
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+
+class MetricsBuffer:
+    """
+    Buffers counters and histograms and writes them on flush().
+
+    Not thread-safe: record from the handler thread only.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        mode: str = 'emf',
+        dimensions: Optional[Dict[str, Any]] = None,
+        client=None,
+        emit: Callable[[str], None] = _write_stdout,
+    ):
+        """
+        Args:
+            namespace: CloudWatch namespace
+            mode: 'emf', 'api' or 'off'
+            dimensions: Dimensions added to every metric
+            client: CloudWatch client (api mode; created on first flush if omitted)
+            emit: Sink for EMF log lines
+        """
+        self.namespace = namespace
+        self.mode = mode.lower()
+        self.default_dimensions = {name: str(value) for name, value in (dimensions or {}).items()}
+        self._client = client
+        self._emit = emit
+
+        # (dimensions, name, unit) -> total
+        self._counters: Dict[Tuple, float] = {}
+        # (dimensions, name, unit, storage_resolution) -> Counter(value -> count)
+        self._histograms: Dict[Tuple, Counter] = {}
+
+    def _dimension_key(self, dimensions: Optional[Dict[str, Any]]) -> Tuple:
+        merged = dict(self.default_dimensions)
+        if dimensions:
+            merged.update((name, str(value)) for name, value in dimensions.items())
+        return tuple(sorted(merged.items()))
+
+    def increment(
+        self,
+        name: str,
+        value: float = 1,
+        unit: str = 'Count',
+        dimensions: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Add to a counter."""
+        key = (self._dimension_key(dimensions), name, unit)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def record(
+        self,
+        name: str,
+        value: float,
+        unit: str = 'Milliseconds',
+        dimensions: Optional[Dict[str, Any]] = None,
+        high_resolution: bool = True,
+        count: int = 1,
+    ) -> None:
+        """Add a sample (or `count` samples of the same value) to a histogram."""
+        key = (self._dimension_key(dimensions), name, unit, 1 if high_resolution else 60)
+        rounded = float(f"{value:.{HISTOGRAM_SIGNIFICANT_DIGITS}g}")
+        self._histograms.setdefault(key, Counter())[rounded] += count
+
+    @contextmanager
+    def timer(self, name: str, dimensions: Optional[Dict[str, Any]] = None) -> Iterator[None]:
+        """Record the duration of the block in milliseconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000, dimensions=dimensions)
+
+    def flush(self) -> int:
+        """
+        Write and clear everything buffered.
+
+        Failures are logged, never raised: metrics must not fail the function.
+
+        Returns:
+            Number of EMF log lines or put_metric_data calls made
+        """
+        counters, histograms = self._counters, self._histograms
+        self._counters, self._histograms = {}, {}
+
+        if self.mode == 'off' or not (counters or histograms):
+            return 0
+
+        try:
+            if self.mode == 'api':
+                return self._flush_api(counters, histograms)
+            return self._flush_emf(counters, histograms)
+        except Exception as e:
+            logger.warning(f"Failed to publish CloudWatch metrics: {str(e)}")
+            return 0
+
+    def _flush_emf(self, counters: Dict[Tuple, float], histograms: Dict[Tuple, Counter]) -> int:
+        # dimensions -> [(name, unit, storage_resolution, [value or (value, count)])]
+        groups: Dict[Tuple, List] = {}
+        for (dimensions, name, unit), total in counters.items():
+            groups.setdefault(dimensions, []).append((name, unit, 60, [total]))
+        for (dimensions, name, unit, resolution), histogram in histograms.items():
+            groups.setdefault(dimensions, []).append((name, unit, resolution, sorted(histogram.items())))
+
+        timestamp = int(time.time() * 1000)
+        lines = 0
+
+        for dimensions, metrics in groups.items():
+            # Histograms with more than EMF_MAX_VALUES_PER_METRIC distinct values spill
+            # over into further documents with the same dimensions
+            chunk = 0
+            while True:
+                start = chunk * EMF_MAX_VALUES_PER_METRIC
+                present = [
+                    (name, unit, resolution, values[start:start + EMF_MAX_VALUES_PER_METRIC])
+                    for name, unit, resolution, values in metrics
+                    if len(values) > start
+                ]
+                if not present:
+                    break
+
+                document = {
+                    '_aws': {
+                        'Timestamp': timestamp,
+                        'CloudWatchMetrics': [{
+                            'Namespace': self.namespace,
+                            'Dimensions': [[name for name, _ in dimensions]],
+                            'Metrics': [
+                                {'Name': name, 'Unit': unit, 'StorageResolution': resolution}
+                                for name, unit, resolution, _ in present
+                            ],
+                        }],
+                    },
+                }
+                document.update(dimensions)
+                for name, _, _, values in present:
+                    document[name] = self._emf_value(values)
+
+                self._emit(json.dumps(document, separators=(',', ':')))
+                lines += 1
+                chunk += 1
+
+        return lines
+
+    @staticmethod
+    def _emf_value(values: List) -> Any:
+        """A counter total, or a histogram chunk as distinct values with counts."""
+        if not isinstance(values[0], tuple):
+            return values[0]
+        if len(values) == 1 and values[0][1] == 1:
+            return values[0][0]
+        return {
+            'Values': [value for value, _ in values],
+            'Counts': [count for _, count in values],
+            'Min': values[0][0],
+            'Max': values[-1][0],
+            'Count': sum(count for _, count in values),
+            'Sum': sum(value * count for value, count in values),
+        }
+
+    def _flush_api(self, counters: Dict[Tuple, float], histograms: Dict[Tuple, Counter]) -> int:
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('cloudwatch')
+
+        timestamp = datetime.utcnow()
+        metric_data = []
+
+        for (dimensions, name, unit), total in counters.items():
+            metric_data.append({
+                'MetricName': name,
+                'Dimensions': [{'Name': key, 'Value': value} for key, value in dimensions],
+                'Value': total,
+                'Unit': unit,
+                'Timestamp': timestamp,
+            })
+
+        for (dimensions, name, unit, resolution), histogram in histograms.items():
+            items = sorted(histogram.items())
+            for start in range(0, len(items), API_MAX_VALUES_PER_DATUM):
+                chunk = items[start:start + API_MAX_VALUES_PER_DATUM]
+                metric_data.append({
+                    'MetricName': name,
+                    'Dimensions': [{'Name': key, 'Value': value} for key, value in dimensions],
+                    'Values': [value for value, _ in chunk],
+                    'Counts': [float(count) for _, count in chunk],
+                    'Unit': unit,
+                    'StorageResolution': resolution,
+                    'Timestamp': timestamp,
+                })
+
+        calls = 0
+        for start in range(0, len(metric_data), API_MAX_DATA_PER_CALL):
+            self._client.put_metric_data(
+                Namespace=self.namespace,
+                MetricData=metric_data[start:start + API_MAX_DATA_PER_CALL],
+            )
+            calls += 1
+
+        logger.debug(f"Published {len(metric_data)} CloudWatch metric data points in {calls} calls")
+        return calls
@@ -46,6 +46,9 @@ zip -r ../stream-processor.zip . \
     -x ".gitignore" \
     > /dev/null 2>&1
 
+# Add modules shared between the Lambda functions (flattened into the root)
+zip -j ../stream-processor.zip ../shared/*.py > /dev/null 2>&1
+
 ZIP_SIZE=$(ls -lh ../stream-processor.zip | awk '{print $5}')
 echo "  ✓ Created stream-processor.zip (${ZIP_SIZE})"
 
@@ -67,6 +70,8 @@ rm -rf urllib3/ 2>/dev/null || true
 rm -rf s3transfer/ 2>/dev/null || true
 rm -rf jmespath/ 2>/dev/null || true
 rm -rf click/ 2>/dev/null || true
+rm -rf simplejson/ 2>/dev/null || true
+rm -rf msgpack/ 2>/dev/null || true
 
 # Remove .dist-info directories
 rm -rf *.dist-info/ 2>/dev/null || true
@@ -10,72 +10,499 @@ This Lambda function:
 Author: POC Chargeback Team
 """
 
-import json
 import logging
 import os
-from typing import Dict, List, Any
+import random
+import threading
+import time
+from decimal import Decimal
+from functools import lru_cache
+from typing import Dict, List, Any, Optional
 from datetime import datetime
 
+from event_codec import get_serializer
+from instrumentation import Instrumentation
+from metrics import MetricsBuffer
+
 # Environment variables
 MSK_BOOTSTRAP_SERVERS = os.environ['MSK_BOOTSTRAP_SERVERS']
 KAFKA_TOPIC = os.environ['KAFKA_TOPIC']
 AWS_REGION = os.environ['AWS_REGION']
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
 
+# Publishing configuration
+# pipelined: send the whole batch, flush once, then collect every ack
+# sync: wait for each record's ack before sending the next one
+PUBLISH_MODE = os.environ.get('PUBLISH_MODE', 'pipelined').lower()
+KAFKA_ACK_TIMEOUT_SECONDS = float(os.environ.get('KAFKA_ACK_TIMEOUT_SECONDS', '10'))
+KAFKA_FLUSH_TIMEOUT_SECONDS = float(os.environ.get('KAFKA_FLUSH_TIMEOUT_SECONDS', '30'))
+
+# Numeric decoding for DynamoDB 'N' values
+# decimal: exact Decimal for every number
+# minor_units: integer minor units (cents) for MINOR_UNIT_ATTRIBUTES, Decimal elsewhere
+# float: int when the value has no '.', float otherwise (legacy behaviour)
+NUMBER_MODE = os.environ.get('NUMBER_MODE', 'decimal').lower()
+MINOR_UNIT_ATTRIBUTES = frozenset(
+    name.strip() for name in os.environ.get('MINOR_UNIT_ATTRIBUTES', 'amount').split(',') if name.strip()
+)
+
+# Kafka payload format (json or msgpack), see event_codec.py
+EVENT_SERIALIZER = os.environ.get('EVENT_SERIALIZER', 'json').lower()
+serialize_event = get_serializer(EVENT_SERIALIZER)
+
+# MODIFY event payload
+# full: complete data and old_data images
+# delta: key plus changed/added attributes and removed attribute names
+MODIFY_EVENT_MODE = os.environ.get('MODIFY_EVENT_MODE', 'full').lower()
+
+# Fold multiple events for the same item within a batch into one event
+COALESCE_EVENTS = os.environ.get('COALESCE_EVENTS', 'false').lower() == 'true'
+
+# Self-generated changes
+# MODIFY events that only change IGNORED_ATTRIBUTES (by default the metadata
+# written back by the consolidation updater) are not business changes: they
+# are dropped, or published to METADATA_EVENTS_TOPIC when it is set.
+# An empty IGNORED_ATTRIBUTES publishes every event as before.
+IGNORED_ATTRIBUTES = frozenset(
+    name.strip() for name in os.environ.get(
+        'IGNORED_ATTRIBUTES',
+        'consolidation_status,consolidation_s3_path,consolidation_date,consolidation_execution,'
+        'consolidation_job_name,output_format,records_in_consolidation,updated_at',
+    ).split(',') if name.strip()
+)
+METADATA_EVENTS_TOPIC = os.environ.get('METADATA_EVENTS_TOPIC', '')
+
+# CloudWatch metrics (see metrics.py)
+# emf: Embedded Metric Format log lines, no API calls; api: one batched
+# put_metric_data per invocation; off: disabled
+METRICS_MODE = os.environ.get('METRICS_MODE', 'emf').lower()
+metrics = MetricsBuffer('POC-Chargeback/StreamProcessor', METRICS_MODE)
+
+# Per-stage timing breakdown (see instrumentation.py)
+# A TIMINGS: line is logged for this fraction of invocations (0 disables);
+# OTEL_TRACING also exports the stages as OpenTelemetry spans
+INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('INSTRUMENTATION_SAMPLE_RATE', '1'))
+OTEL_TRACING = os.environ.get('OTEL_TRACING', 'false').lower() == 'true'
+instrumentation = Instrumentation('stream-processor', INSTRUMENTATION_SAMPLE_RATE, OTEL_TRACING)
+
+# Kafka connection settings
+# SASL_SSL uses MSK IAM authentication; PLAINTEXT is for local Kafka stand-ins
+KAFKA_SECURITY_PROTOCOL = os.environ.get('KAFKA_SECURITY_PROTOCOL', 'SASL_SSL').upper()
+# Broker API version (e.g. "2.8.1"); setting it skips the version probe on connect
+KAFKA_API_VERSION = os.environ.get('KAFKA_API_VERSION', '')
+
+# Cold-start warm-up: create the producer during Lambda init and optionally
+# prefetch KAFKA_TOPIC metadata, bounded by WARMUP_TIMEOUT_SECONDS
+PRODUCER_WARMUP = os.environ.get('PRODUCER_WARMUP', 'true').lower() == 'true'
+WARMUP_METADATA_PREFETCH = os.environ.get('WARMUP_METADATA_PREFETCH', 'true').lower() == 'true'
+WARMUP_TIMEOUT_SECONDS = float(os.environ.get('WARMUP_TIMEOUT_SECONDS', '5'))
+
+# Producer health checking and reconnects (see ManagedProducer)
+PRODUCER_MAX_IDLE_SECONDS = float(os.environ.get('PRODUCER_MAX_IDLE_SECONDS', '300'))
+PRODUCER_PROBE_TIMEOUT_SECONDS = float(os.environ.get('PRODUCER_PROBE_TIMEOUT_SECONDS', '2'))
+PRODUCER_RECONNECT_ATTEMPTS = int(os.environ.get('PRODUCER_RECONNECT_ATTEMPTS', '3'))
+PRODUCER_RECONNECT_BACKOFF_SECONDS = float(os.environ.get('PRODUCER_RECONNECT_BACKOFF_SECONDS', '0.1'))
+PRODUCER_RECONNECT_BACKOFF_MAX_SECONDS = float(os.environ.get('PRODUCER_RECONNECT_BACKOFF_MAX_SECONDS', '2'))
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(getattr(logging, LOG_LEVEL))
 
+def create_kafka_producer():
+    """
+    Create a Kafka producer with MSK IAM authentication.
+    
+    Returns:
+        New KafkaProducer instance
+    """
+    from kafka import KafkaProducer
+    
+    logger.info("Initializing Kafka producer...")
+    
+    if KAFKA_SECURITY_PROTOCOL == 'SASL_SSL':
+        from aws_msk_iam_sasl_signer import MSKAuthTokenProvider
+        
+        # MSK IAM authentication
+        security_config = {
+            'security_protocol': 'SASL_SSL',
+            'sasl_mechanism': 'OAUTHBEARER',
+            'sasl_oauth_token_provider': MSKAuthTokenProvider(region=AWS_REGION),
+        }
+    else:
+        security_config = {'security_protocol': KAFKA_SECURITY_PROTOCOL}
+    
+    if KAFKA_API_VERSION:
+        security_config['api_version'] = tuple(int(part) for part in KAFKA_API_VERSION.split('.'))
+    
+    producer = KafkaProducer(
+        bootstrap_servers=MSK_BOOTSTRAP_SERVERS.split(','),
+        value_serializer=serialize_event,
+        key_serializer=lambda k: k.encode('utf-8') if k else None,
+        # Producer configuration
+        acks='all',  # Wait for all replicas
+        retries=3,
+        # kafka-python has no idempotent producer, so with several requests in
+        # flight a retried batch can land after a later one and reorder a
+        # chargeback's events. Pipelined mode keeps one request in flight per
+        # broker (records are still batched by linger_ms/batch_size); sync
+        # mode never has more than one record outstanding anyway.
+        max_in_flight_requests_per_connection=1 if PUBLISH_MODE == 'pipelined' else 5,
+        compression_type='snappy',
+        linger_ms=10,  # Batch messages for efficiency
+        batch_size=16384,
+        **security_config,
+    )
+    
+    logger.info("Kafka producer initialized successfully")
+    return producer
+
+
+class ManagedProducer:
+    """
+    Container-wide Kafka producer with liveness checks and bounded reconnects.
+    
+    The producer is created once and reused across invocations. Before it is
+    handed out it is checked: a dead sender thread, an explicit
+    mark_unhealthy() (e.g. no record of the last batch was delivered and
+    Kafka reported errors, see producer_looks_broken) or a failed
+    metadata probe after PRODUCER_MAX_IDLE_SECONDS of inactivity all trigger
+    a reconnect. Reconnects close the old client and retry creation up to
+    PRODUCER_RECONNECT_ATTEMPTS times with jittered exponential backoff.
+    """
+    
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self.producer = None
+        self._healthy = True
+        self._last_used = time.monotonic()
+        
+        # Metrics (cumulative for the container)
+        self.reconnect_count = 0
+        self.reconnect_seconds = 0.0
+        self.failed_reconnects = 0
+    
+    def get(self):
+        """Return a producer that passed the liveness checks."""
+        with self._lock:
+            if self.producer is None:
+                self.producer = self._create()
+            elif not self._is_alive():
+                self._reconnect()
+            
+            self._last_used = time.monotonic()
+            return self.producer
+    
+    def mark_unhealthy(self, reason: str) -> None:
+        """Force a reconnect on the next get()."""
+        logger.warning(f"Kafka producer marked unhealthy: {reason}")
+        self._healthy = False
+    
+    def reconnect(self):
+        """Replace the producer immediately and return the new one."""
+        with self._lock:
+            self._reconnect()
+            self._last_used = time.monotonic()
+            return self.producer
+    
+    def stats(self) -> Dict:
+        """Reconnect metrics for this container."""
+        return {
+            'producer_reconnects': self.reconnect_count,
+            'producer_reconnect_ms': round(self.reconnect_seconds * 1000, 1),
+            'producer_failed_reconnects': self.failed_reconnects,
+        }
+    
+    def _create(self):
+        producer = self._factory()
+        self._healthy = True
+        return producer
+    
+    def _is_alive(self) -> bool:
+        if not self._healthy:
+            return False
+        
+        # kafka-python runs all network I/O on its sender thread
+        sender = getattr(self.producer, '_sender', None)
+        if sender is not None and not sender.is_alive():
+            logger.warning("Kafka producer sender thread is not running")
+            return False
+        
+        if time.monotonic() - self._last_used > PRODUCER_MAX_IDLE_SECONDS:
+            return self._probe()
+        
+        return True
+    
+    def _probe(self) -> bool:
+        """Force a metadata round trip to the cluster, bounded by a timeout."""
+        metadata = getattr(self.producer, '_metadata', None)
+        sender = getattr(self.producer, '_sender', None)
+        if metadata is None or sender is None:
+            return True
+        
+        started = time.monotonic()
+        future = metadata.request_update()
+        sender.wakeup()
+        
+        while not future.is_done:
+            if time.monotonic() - started > PRODUCER_PROBE_TIMEOUT_SECONDS:
+                logger.warning(f"Kafka metadata probe timed out after {PRODUCER_PROBE_TIMEOUT_SECONDS}s")
+                return False
+            time.sleep(0.01)
+        
+        if future.failed():
+            logger.warning(f"Kafka metadata probe failed: {future.exception}")
+            return False
+        
+        logger.debug(f"Kafka metadata probe succeeded in {(time.monotonic() - started) * 1000:.0f} ms")
+        return True
+    
+    def _reconnect(self) -> None:
+        started = time.monotonic()
+        old_producer, self.producer = self.producer, None
+        
+        if old_producer is not None:
+            try:
+                old_producer.close(timeout=0)
+            except Exception as e:
+                logger.debug(f"Ignoring error while closing Kafka producer: {str(e)}")
+        
+        try:
+            for attempt in range(1, PRODUCER_RECONNECT_ATTEMPTS + 1):
+                try:
+                    self.producer = self._create()
+                    break
+                except Exception as e:
+                    logger.warning(f"Kafka reconnect attempt {attempt}/{PRODUCER_RECONNECT_ATTEMPTS} failed: {str(e)}")
+                    if attempt == PRODUCER_RECONNECT_ATTEMPTS:
+                        self.failed_reconnects += 1
+                        raise
+                    # Exponential backoff with full jitter
+                    backoff = min(
+                        PRODUCER_RECONNECT_BACKOFF_MAX_SECONDS,
+                        PRODUCER_RECONNECT_BACKOFF_SECONDS * (2 ** (attempt - 1)),
+                    )
+                    time.sleep(random.uniform(0, backoff))
+        finally:
+            elapsed = time.monotonic() - started
+            self.reconnect_count += 1
+            self.reconnect_seconds += elapsed
+        
+        logger.info(f"Kafka producer reconnected in {elapsed * 1000:.0f} ms")
+
+
 # Kafka producer (initialized once per Lambda container)
-kafka_producer = None
+producer_manager = ManagedProducer(create_kafka_producer)
 
 
 def get_kafka_producer():
     """
-    Initialize Kafka producer with MSK IAM authentication.
-    This is called once per Lambda container (cold start).
+    Return the container's Kafka producer, reconnecting if it is unhealthy.
+    The first call (normally warm_up_producer during init) creates it.
     """
-    global kafka_producer
+    with instrumentation.stage('producer_get'):
+        return producer_manager.get()
+
+
+def warm_up_producer() -> bool:
+    """
+    Create the Kafka producer and prefetch topic metadata during Lambda init.
     
-    if kafka_producer is None:
+    Runs in a daemon thread bounded by WARMUP_TIMEOUT_SECONDS so a slow or
+    unreachable cluster cannot stall init. Failures are logged and left to
+    the first invocation, which calls get_kafka_producer again.
+    
+    Returns:
+        True if warm-up finished within the timeout
+    """
+    def _warm_up():
+        producer = get_kafka_producer()
+        if WARMUP_METADATA_PREFETCH:
+            partitions = producer.partitions_for(KAFKA_TOPIC)
+            logger.info(f"Prefetched metadata for {KAFKA_TOPIC}: {len(partitions or ())} partitions")
+    
+    def _run():
         try:
-            from kafka import KafkaProducer
-            from aws_msk_iam_sasl_signer import MSKAuthTokenProvider
-            
-            logger.info("Initializing Kafka producer...")
-            
-            # MSK IAM authentication
-            tp = MSKAuthTokenProvider(region=AWS_REGION)
-            
-            kafka_producer = KafkaProducer(
-                bootstrap_servers=MSK_BOOTSTRAP_SERVERS.split(','),
-                security_protocol='SASL_SSL',
-                sasl_mechanism='OAUTHBEARER',
-                sasl_oauth_token_provider=tp,
-                value_serializer=lambda v: json.dumps(v).encode('utf-8'),
-                key_serializer=lambda k: k.encode('utf-8') if k else None,
-                # Producer configuration
-                acks='all',  # Wait for all replicas
-                retries=3,
-                max_in_flight_requests_per_connection=5,
-                compression_type='snappy',
-                linger_ms=10,  # Batch messages for efficiency
-                batch_size=16384,
-            )
-            
-            logger.info("Kafka producer initialized successfully")
-            
+            _warm_up()
         except Exception as e:
-            logger.error(f"Failed to initialize Kafka producer: {str(e)}")
-            raise
+            logger.warning(f"Producer warm-up failed, deferring to first invocation: {str(e)}")
+    
+    started = time.monotonic()
+    thread = threading.Thread(target=_run, name='kafka-warm-up', daemon=True)
+    thread.start()
+    thread.join(WARMUP_TIMEOUT_SECONDS)
+    elapsed_ms = (time.monotonic() - started) * 1000
+    
+    if thread.is_alive():
+        logger.warning(f"Producer warm-up still running after {elapsed_ms:.0f} ms, continuing init")
+        return False
+    
+    logger.info(f"Producer warm-up finished in {elapsed_ms:.0f} ms")
+    return True
+
+
+def _decode_number_as_float(raw: str):
+    """Decode a DynamoDB 'N' string into int or float."""
+    return float(raw) if '.' in raw else int(raw)
+
+
+_NUMBER_DECODERS = {
+    'decimal': Decimal,
+    'minor_units': Decimal,
+    'float': _decode_number_as_float,
+}
+
+if NUMBER_MODE not in _NUMBER_DECODERS:
+    raise ValueError(f"Unsupported NUMBER_MODE: {NUMBER_MODE} (expected one of {sorted(_NUMBER_DECODERS)})")
+
+_decode_number = _NUMBER_DECODERS[NUMBER_MODE]
+
+
+def to_minor_units(value: Any) -> Any:
+    """Convert a decoded monetary amount into integer minor units (cents)."""
+    if isinstance(value, Decimal):
+        return int((value * 100).to_integral_value())
+    return value
+
+
+# Decoders for the remaining non-container DynamoDB types. Binary values
+# arrive base64-encoded in stream events and are kept that way so the event
+# stays JSON-serializable; sets become lists for the same reason.
+_OTHER_SCALAR_DECODERS = {
+    'NULL': lambda raw: None,
+    'B': lambda raw: raw,
+    'SS': list,
+    'NS': lambda raw: [_decode_number(n) for n in raw],
+    'BS': list,
+}
+
+
+def _decode_other(value: Dict) -> Any:
+    """Decode a non-S/N/BOOL attribute value (maps and lists iteratively)."""
+    (tag, raw), = value.items()
+    if tag == 'M':
+        nested = {}
+        _fill_container(nested, raw)
+        return nested
+    if tag == 'L':
+        nested = [None] * len(raw)
+        _fill_container(nested, raw)
+        return nested
+    decoder = _OTHER_SCALAR_DECODERS.get(tag)
+    if decoder is None:
+        raise ValueError(f"Unsupported DynamoDB attribute type: {tag}")
+    return decoder(raw)
+
+
+def _fill_container(root: Any, raw_root: Any) -> None:
+    """
+    Decode DynamoDB-JSON children into an (empty) dict or list, iteratively.
+    
+    Scalars are decoded in place; nested maps and lists get their container
+    assigned immediately (preserving attribute order) and are queued on an
+    explicit stack instead of recursing.
+    """
+    stack = [(root, raw_root)]
+    
+    while stack:
+        container, raw_children = stack.pop()
+        children = raw_children.items() if type(container) is dict else enumerate(raw_children)
+        
+        for slot, value in children:
+            if 'S' in value:
+                container[slot] = value['S']
+            elif 'N' in value:
+                container[slot] = _decode_number(value['N'])
+            elif 'BOOL' in value:
+                container[slot] = value['BOOL']
+            elif 'M' in value:
+                raw = value['M']
+                nested = {}
+                container[slot] = nested
+                stack.append((nested, raw))
+            elif 'L' in value:
+                raw = value['L']
+                nested = [None] * len(raw)
+                container[slot] = nested
+                stack.append((nested, raw))
+            else:
+                container[slot] = _decode_other(value)
+
+
+def deserialize_image(image: Dict) -> Dict:
+    """
+    Convert a DynamoDB Stream image (NewImage/OldImage) into a Python dict.
+    
+    Covers every DynamoDB type. The top level is a flat loop for the S/N/BOOL
+    attributes of the chargeback schema; only nested maps and lists go
+    through the stack-based walker, so they are decoded without recursion.
+    Numbers are decoded according to NUMBER_MODE.
+    
+    Args:
+        image: DynamoDB-JSON attribute map
+        
+    Returns:
+        Plain Python dict
+    """
+    decode_number = _decode_number
+    result = {}
+    
+    for name, value in image.items():
+        if 'S' in value:
+            result[name] = value['S']
+        elif 'N' in value:
+            result[name] = decode_number(value['N'])
+        elif 'BOOL' in value:
+            result[name] = value['BOOL']
+        else:
+            result[name] = _decode_other(value)
+    
+    if NUMBER_MODE == 'minor_units':
+        for name in MINOR_UNIT_ATTRIBUTES.intersection(result):
+            result[name] = to_minor_units(result[name])
     
-    return kafka_producer
+    return result
+
+
+@lru_cache(maxsize=32)
+def table_name_from_arn(event_source_arn: str) -> str:
+    """Extract the table name from a DynamoDB Stream ARN (cached per ARN)."""
+    return event_source_arn.split('/')[-3]
+
+
+def diff_images(old_image: Dict, new_image: Dict) -> tuple:
+    """
+    Compare two DynamoDB-JSON images attribute by attribute.
+    
+    The comparison runs on the raw type-tagged values, so only attributes that
+    actually changed are deserialized.
+    
+    Args:
+        old_image: OldImage from the stream record
+        new_image: NewImage from the stream record
+        
+    Returns:
+        Tuple of (changes, removed): changed or added attributes as plain
+        values, and the names of attributes missing from new_image
+    """
+    changed = {
+        name: value for name, value in new_image.items()
+        if old_image.get(name) != value
+    }
+    removed = [name for name in old_image if name not in new_image]
+    
+    return deserialize_image(changed), removed
 
 
 def transform_dynamodb_record(record: Dict) -> Dict:
     """
     Transform DynamoDB Stream record to business event format.
     
+    With MODIFY_EVENT_MODE=delta, MODIFY records carry 'keys', 'changes'
+    and 'removed' instead of the full 'data'/'old_data' images. Records
+    folded by coalesce_records also carry 'coalesced_count' and
+    'sequence_range'.
+    
     Args:
         record: DynamoDB Stream record
         
@@ -88,113 +515,445 @@ def transform_dynamodb_record(record: Dict) -> Dict:
     new_image = record['dynamodb'].get('NewImage', {})
     old_image = record['dynamodb'].get('OldImage', {})
     
-    # Transform DynamoDB format to simple dict
-    def dynamodb_to_dict(ddb_item):
-        """Convert DynamoDB format to Python dict"""
-        result = {}
-        for key, value in ddb_item.items():
-            # Get the actual value from DynamoDB type wrapper
-            if 'S' in value:
-                result[key] = value['S']
-            elif 'N' in value:
-                result[key] = float(value['N']) if '.' in value['N'] else int(value['N'])
-            elif 'BOOL' in value:
-                result[key] = value['BOOL']
-            elif 'NULL' in value:
-                result[key] = None
-            elif 'M' in value:
-                result[key] = dynamodb_to_dict(value['M'])
-            elif 'L' in value:
-                result[key] = [dynamodb_to_dict({'item': item})['item'] for item in value['L']]
-        return result
-    
     # Build the event
     event = {
         'event_type': event_name,
         'event_timestamp': datetime.utcnow().isoformat(),
-        'table_name': record['eventSourceARN'].split('/')[-3],
+        'table_name': table_name_from_arn(record['eventSourceARN']),
         'event_id': record['eventID'],
-        'data': dynamodb_to_dict(new_image) if new_image else None,
-        'old_data': dynamodb_to_dict(old_image) if old_image and event_name == 'MODIFY' else None,
     }
     
+    coalesced = record.get('coalesced')
+    if coalesced:
+        event['coalesced_count'] = coalesced['count']
+        event['sequence_range'] = {
+            'first': coalesced['first_sequence_number'],
+            'last': coalesced['last_sequence_number'],
+        }
+    
+    if event_name == 'MODIFY' and MODIFY_EVENT_MODE == 'delta' and new_image and old_image:
+        # Compact patch: key plus what changed, no full images
+        changes, removed = diff_images(old_image, new_image)
+        event['data'] = None
+        event['old_data'] = None
+        event['keys'] = deserialize_image(record['dynamodb'].get('Keys', {}))
+        event['changes'] = changes
+        event['removed'] = removed
+        return event
+    
+    event['data'] = deserialize_image(new_image) if new_image else None
+    event['old_data'] = deserialize_image(old_image) if old_image and event_name == 'MODIFY' else None
+    
     return event
 
 
-def lambda_handler(event: Dict, context: Any) -> Dict:
+def is_metadata_only_change(record: Dict) -> bool:
     """
-    Lambda handler function.
+    Whether a MODIFY record only touches IGNORED_ATTRIBUTES.
+    
+    Compares the raw type-tagged images, stopping at the first attribute
+    outside IGNORED_ATTRIBUTES that was changed, added or removed. Records
+    without both images (e.g. a NEW_IMAGE stream) are never treated as
+    metadata-only.
     
     Args:
-        event: DynamoDB Stream event
-        context: Lambda context
+        record: DynamoDB Stream record (possibly coalesced)
         
     Returns:
-        Response with success/failure counts
+        True if the record should not be published as a business change
     """
-    logger.info(f"Processing {len(event['Records'])} DynamoDB Stream records")
+    if not IGNORED_ATTRIBUTES or record.get('eventName') != 'MODIFY':
+        return False
     
-    producer = get_kafka_producer()
+    stream_data = record.get('dynamodb', {})
+    new_image = stream_data.get('NewImage')
+    old_image = stream_data.get('OldImage')
+    if not new_image or not old_image:
+        return False
+    
+    for name, value in new_image.items():
+        if name not in IGNORED_ATTRIBUTES and old_image.get(name) != value:
+            return False
+    
+    for name in old_image:
+        if name not in new_image and name not in IGNORED_ATTRIBUTES:
+            return False
+    
+    return True
+
+
+def record_topic(record: Dict) -> Optional[str]:
+    """Kafka topic for a record, or None when it is suppressed."""
+    if is_metadata_only_change(record):
+        return METADATA_EVENTS_TOPIC or None
+    return KAFKA_TOPIC
+
+
+def event_partition_key(event: Dict) -> Any:
+    """Kafka partitioning key (chargeback_id) for a full or delta event."""
+    image = event['data'] or event.get('keys')
+    return image.get('chargeback_id') if image else None
+
+
+def coalesce_records(records: List[Dict]) -> List[Dict]:
+    """
+    Fold stream records for the same item key into a single record.
+    
+    The folded record carries the last NewImage, the OldImage from before the
+    first event, and a 'coalesced' summary with the collapsed sequence range.
+    An INSERT followed by MODIFYs stays an INSERT; anything ending in REMOVE
+    becomes a REMOVE. Its SequenceNumber is the first member's, so a failure
+    checkpoints before every event it replaced.
+    
+    Output is ordered by each key's first appearance; only one event per key
+    remains, so per-key ordering is preserved.
+    
+    Args:
+        records: DynamoDB Stream records in stream order
+        
+    Returns:
+        Records to publish, one per distinct item key
+    """
+    groups = {}
+    
+    for index, record in enumerate(records):
+        keys = record.get('dynamodb', {}).get('Keys')
+        if keys:
+            group_key = tuple(
+                (name, tag, raw)
+                for name, value in sorted(keys.items())
+                for tag, raw in value.items()
+            )
+        else:
+            # No key to fold on: publish as-is
+            group_key = ('__record__', index)
+        groups.setdefault(group_key, []).append(record)
+    
+    coalesced = []
+    for members in groups.values():
+        if len(members) == 1:
+            coalesced.append(members[0])
+            continue
+        
+        first, last = members[0], members[-1]
+        
+        if last['eventName'] == 'REMOVE':
+            event_name = 'REMOVE'
+        elif first['eventName'] == 'INSERT':
+            event_name = 'INSERT'
+        else:
+            event_name = last['eventName']
+        
+        stream_data = dict(last['dynamodb'])
+        stream_data['SequenceNumber'] = first['dynamodb'].get('SequenceNumber')
+        stream_data.pop('OldImage', None)
+        if event_name != 'INSERT' and 'OldImage' in first['dynamodb']:
+            stream_data['OldImage'] = first['dynamodb']['OldImage']
+        
+        record = dict(last)
+        record['eventName'] = event_name
+        record['dynamodb'] = stream_data
+        record['coalesced'] = {
+            'count': len(members),
+            'first_sequence_number': first['dynamodb'].get('SequenceNumber'),
+            'last_sequence_number': last['dynamodb'].get('SequenceNumber'),
+            'event_ids': [member.get('eventID') for member in members],
+        }
+        coalesced.append(record)
+    
+    return coalesced
+
+
+def publish_records(producer, records: List[Dict]) -> List[Dict]:
+    """
+    Transform DynamoDB Stream records and publish them to Kafka.
+    
+    In 'pipelined' mode every record is handed to the producer first and the
+    delivery futures are resolved once, after a single flush, so the
+    linger_ms/batch_size batching configured in get_kafka_producer covers the
+    whole batch. In 'sync' mode each send waits for its own acknowledgement.
+    
+    Args:
+        producer: Kafka producer (or any object with send/flush)
+        records: DynamoDB Stream records
+        
+    Metadata-only changes (see is_metadata_only_change) are sent to
+    METADATA_EVENTS_TOPIC, or not sent at all and marked 'suppressed'.
+    
+    Returns:
+        One outcome per record, in input order, with keys
+        'record', 'topic', 'suppressed', 'metadata' (RecordMetadata on
+        success) and 'error'
+    """
+    outcomes = [
+        {'record': record, 'topic': None, 'suppressed': False, 'metadata': None, 'error': None}
+        for record in records
+    ]
+    pending = []
     
-    success_count = 0
-    failure_count = 0
-    failures = []
+    # Per-record stage times, summed locally and reported once
+    clock = time.perf_counter
+    transform_seconds = send_seconds = ack_seconds = 0.0
     
-    for record in event['Records']:
+    for outcome in outcomes:
         try:
+            started = clock()
+            topic = record_topic(outcome['record'])
+            if topic is None:
+                outcome['suppressed'] = True
+                transform_seconds += clock() - started
+                continue
+            outcome['topic'] = topic
+            
             # Transform DynamoDB record
-            transformed_event = transform_dynamodb_record(record)
+            transformed_event = transform_dynamodb_record(outcome['record'])
             
             # Extract key for Kafka partitioning (chargeback_id)
-            key = transformed_event['data'].get('chargeback_id') if transformed_event['data'] else None
+            key = event_partition_key(transformed_event)
+            sent = clock()
+            transform_seconds += sent - started
             
             # Send to Kafka
             future = producer.send(
-                topic=KAFKA_TOPIC,
+                topic=topic,
                 key=key,
                 value=transformed_event,
             )
+            send_seconds += clock() - sent
             
-            # Wait for confirmation (with timeout)
-            result = future.get(timeout=10)
-            
+            if PUBLISH_MODE == 'sync':
+                started = clock()
+                outcome['metadata'] = future.get(timeout=KAFKA_ACK_TIMEOUT_SECONDS)
+                ack_seconds += clock() - started
+            else:
+                pending.append((outcome, future))
+                
+        except Exception as e:
+            logger.error(f"Failed to publish record {outcome['record'].get('eventID')}: {str(e)}", exc_info=True)
+            outcome['error'] = e
+    
+    instrumentation.add_time('transform', transform_seconds, len(outcomes))
+    instrumentation.add_time('kafka_send', send_seconds, len(outcomes))
+    
+    # Flush producer to ensure all messages are sent
+    flush_error = None
+    try:
+        with instrumentation.stage('kafka_flush'):
+            producer.flush(timeout=KAFKA_FLUSH_TIMEOUT_SECONDS)
+    except Exception as e:
+        logger.error(f"Kafka flush did not complete: {str(e)}")
+        flush_error = e
+    
+    # Collect acknowledgements for the pipelined sends
+    started = clock()
+    for outcome, future in pending:
+        try:
+            if flush_error is not None and not future.is_done:
+                raise flush_error
+            outcome['metadata'] = future.get(timeout=KAFKA_ACK_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.error(f"Kafka did not acknowledge record {outcome['record'].get('eventID')}: {str(e)}")
+            outcome['error'] = e
+    
+    ack_seconds += clock() - started
+    instrumentation.add_time('kafka_ack', ack_seconds, len(outcomes))
+    
+    for outcome in outcomes:
+        result = outcome['metadata']
+        if result is not None:
             logger.debug(
                 f"Sent message to Kafka: topic={result.topic}, "
                 f"partition={result.partition}, offset={result.offset}"
             )
-            
-            success_count += 1
-            
+    
+    return outcomes
+
+
+def is_kafka_error(error: Exception) -> bool:
+    """
+    Whether an error came from the Kafka client (send, ack or flush).
+    
+    Transform and serialization errors are properties of the record, not of
+    the connection, so they must not trigger a reconnect.
+    """
+    try:
+        from kafka.errors import KafkaError
+    except ImportError:
+        return False
+    return isinstance(error, KafkaError)
+
+
+def producer_looks_broken(outcomes: List[Dict]) -> bool:
+    """
+    True when nothing in the batch was delivered and Kafka itself failed.
+    
+    Records that failed before reaching the producer (transform or
+    serialization errors, e.g. a poison record DynamoDB Streams keeps
+    redelivering) and suppressed records say nothing about the connection,
+    so a batch without any Kafka error never counts as a broken producer.
+    """
+    if any(outcome['metadata'] is not None for outcome in outcomes):
+        return False
+    return any(outcome['error'] is not None and is_kafka_error(outcome['error']) for outcome in outcomes)
+
+
+def build_batch_item_failures(outcomes: List[Dict]) -> List[Dict]:
+    """
+    Build the partial batch response for DynamoDB Streams.
+    
+    DynamoDB Streams checkpoints up to the lowest reported sequence number and
+    retries from there, so only the first failed record is reported. Records
+    before it are never redelivered.
+    
+    Args:
+        outcomes: Per-record outcomes from publish_records, in stream order
+            (coalesced records are ordered by, and carry, their first member's
+            SequenceNumber)
+        
+    Returns:
+        List with at most one {'itemIdentifier': SequenceNumber} entry
+    """
+    for outcome in outcomes:
+        if outcome['error'] is None:
+            continue
+        
+        sequence_number = outcome['record'].get('dynamodb', {}).get('SequenceNumber')
+        if not sequence_number:
+            # Without a sequence number there is no safe checkpoint: retry the batch
+            raise Exception(
+                f"Record {outcome['record'].get('eventID')} failed and has no SequenceNumber"
+            )
+        
+        return [{'itemIdentifier': sequence_number}]
+    
+    return []
+
+
+def record_invocation_metrics(outcomes: List[Dict], publish_ms: float, reconnects: int) -> None:
+    """
+    Buffer this invocation's CloudWatch metrics and write them.
+    
+    StreamLag is the time from the item change (ApproximateCreationDateTime)
+    to its acknowledgement by Kafka, recorded per published record.
+    
+    Args:
+        outcomes: Per-record outcomes from publish_records
+        publish_ms: Time spent publishing the batch, including a retry
+        reconnects: Producer reconnects during this invocation
+    """
+    now = time.time()
+    published = failed = suppressed = metadata = 0
+    
+    for outcome in outcomes:
+        if outcome['error'] is not None:
+            failed += 1
+            continue
+        if outcome['suppressed']:
+            suppressed += 1
+            continue
+        
+        published += 1
+        if METADATA_EVENTS_TOPIC and outcome['topic'] == METADATA_EVENTS_TOPIC:
+            metadata += 1
+        
+        created = outcome['record'].get('dynamodb', {}).get('ApproximateCreationDateTime')
+        if created:
+            metrics.record('StreamLag', max(0.0, (now - float(created)) * 1000))
+    
+    metrics.increment('RecordsPublished', published)
+    metrics.increment('RecordsFailed', failed)
+    metrics.increment('RecordsSuppressed', suppressed)
+    metrics.increment('RecordsMetadata', metadata)
+    metrics.increment('ProducerReconnects', reconnects)
+    metrics.record('BatchPublishLatency', publish_ms)
+    with instrumentation.stage('metrics_flush'):
+        metrics.flush()
+
+
+@instrumentation.handler
+def lambda_handler(event: Dict, context: Any) -> Dict:
+    """
+    Lambda handler function.
+    
+    Args:
+        event: DynamoDB Stream event
+        context: Lambda context
+        
+    Returns:
+        Dict with batchItemFailures for partial batch failure handling
+    """
+    logger.info(f"Processing {len(event['Records'])} DynamoDB Stream records ({PUBLISH_MODE} mode)")
+    
+    records = event['Records']
+    instrumentation.count('records', len(records))
+    if COALESCE_EVENTS:
+        with instrumentation.stage('coalesce'):
+            records = coalesce_records(records)
+        logger.info(f"Coalesced {len(event['Records'])} records into {len(records)} events")
+    
+    reconnects_before = producer_manager.reconnect_count
+    publish_started = time.perf_counter()
+    
+    producer = get_kafka_producer()
+    
+    outcomes = publish_records(producer, records)
+    
+    if producer_looks_broken(outcomes):
+        # Nothing got through and Kafka reported errors: treat the client as
+        # broken, reconnect and retry the batch once instead of burning a
+        # whole Lambda retry cycle
+        failed = sum(1 for outcome in outcomes if outcome['error'] is not None)
+        producer_manager.mark_unhealthy(f"no record delivered, {failed} failed with Kafka errors or earlier")
+        try:
+            with instrumentation.stage('reconnect'):
+                producer = producer_manager.reconnect()
+            outcomes = publish_records(producer, records)
         except Exception as e:
-            logger.error(f"Failed to process record: {str(e)}", exc_info=True)
-            failure_count += 1
-            failures.append({
-                'record_id': record.get('eventID'),
-                'error': str(e)
-            })
+            logger.error(f"Kafka reconnect failed: {str(e)}")
     
-    # Flush producer to ensure all messages are sent
-    producer.flush(timeout=30)
-    
-    response = {
-        'statusCode': 200 if failure_count == 0 else 207,  # 207 = Multi-Status
-        'body': {
-            'processed': len(event['Records']),
-            'succeeded': success_count,
-            'failed': failure_count,
-            'failures': failures[:10]  # Limit to first 10 failures
-        }
-    }
+    publish_ms = (time.perf_counter() - publish_started) * 1000
+    
+    failure_count = sum(1 for outcome in outcomes if outcome['error'] is not None)
+    suppressed_count = sum(1 for outcome in outcomes if outcome['suppressed'])
+    metadata_count = sum(
+        1 for outcome in outcomes
+        if outcome['error'] is None and METADATA_EVENTS_TOPIC and outcome['topic'] == METADATA_EVENTS_TOPIC
+    )
+    success_count = len(outcomes) - failure_count - suppressed_count
+    
+    batch_item_failures = build_batch_item_failures(outcomes)
     
     if failure_count > 0:
-        logger.warning(f"Processed with errors: {success_count} succeeded, {failure_count} failed")
-        # Raise exception to trigger Lambda retry for failed records
-        # DynamoDB Streams will retry failed batches
-        raise Exception(f"Failed to process {failure_count} records")
+        logger.warning(
+            f"Processed with errors: {success_count} succeeded, {failure_count} failed; "
+            f"retrying from sequence number {batch_item_failures[0]['itemIdentifier']}"
+        )
     else:
-        logger.info(f"Successfully processed all {success_count} records")
+        logger.info(
+            f"Successfully processed all records: {success_count} published, "
+            f"{suppressed_count} metadata-only changes suppressed"
+        )
+    
+    producer_stats = producer_manager.stats()
+    logger.info(
+        f"METRICS: records_published={success_count}, records_failed={failure_count}, "
+        f"records_suppressed={suppressed_count}, records_metadata={metadata_count}, "
+        f"producer_reconnects={producer_stats['producer_reconnects']}, "
+        f"producer_reconnect_ms={producer_stats['producer_reconnect_ms']}, "
+        f"producer_failed_reconnects={producer_stats['producer_failed_reconnects']}"
+    )
+    
+    record_invocation_metrics(outcomes, publish_ms, producer_manager.reconnect_count - reconnects_before)
     
-    return response
+    # Return batch item failures so only the failed tail of the batch is retried
+    return {
+        'batchItemFailures': batch_item_failures
+    }
+
+
+# Connect to Kafka during Lambda init instead of on the first event
+if PRODUCER_WARMUP:
+    warm_up_producer()
 
 
 # For local testing
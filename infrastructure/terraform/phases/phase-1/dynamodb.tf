@@ -23,6 +23,11 @@ resource "aws_dynamodb_table" "chargebacks" {
     type = "S" # String
   }
   
+  attribute {
+    name = "created_date_bucket"
+    type = "S" # String - "YYYY-MM-DD#NN" (ver created-date-index)
+  }
+  
   # ----------------------------------------------------------------------------
   # DynamoDB Streams (para event-driven architecture no futuro)
   # ----------------------------------------------------------------------------
@@ -49,6 +54,24 @@ resource "aws_dynamodb_table" "chargebacks" {
   # - Buscar todos chargebacks com status="pending"
   # - Buscar todos chargebacks com status="approved"
   
+  # ----------------------------------------------------------------------------
+  # Global Secondary Index (GSI) para queries por data de criação
+  # ----------------------------------------------------------------------------
+  # Usado pelo consolidation-updater (Phase 4) para encontrar os chargebacks de
+  # um dia com Query em vez de Scan na tabela inteira.
+  #
+  # created_date_bucket = "<YYYY-MM-DD de created_at>#<shard com 2 dígitos>"
+  # shard               = crc32(chargeback_id) % created_date_shards
+  #
+  # O shard espalha ~5M itens/dia por várias partition keys do índice,
+  # evitando hot partition. O writer (API) deve preencher o atributo.
+  global_secondary_index {
+    name            = "created-date-index"
+    hash_key        = "created_date_bucket"
+    range_key       = "chargeback_id"
+    projection_type = "KEYS_ONLY" # O updater só precisa do chargeback_id
+  }
+  
   tags = merge(
     var.tags,
     {
@@ -68,6 +91,7 @@ resource "aws_dynamodb_table" "chargebacks" {
 #   "amount": 150.00,
 #   "currency": "USD",
 #   "created_at": "2025-10-19T10:30:00Z",
+#   "created_date_bucket": "2025-10-19#07",   // GSI Hash Key (created-date-index)
 #   "updated_at": "2025-10-19T10:30:00Z",
 #   "reason": "Product not received",
 #   "metadata": { ... }
@@ -141,6 +141,10 @@ resource "aws_lambda_event_source_mapping" "dynamodb_stream" {
   maximum_record_age_in_seconds = var.lambda_maximum_record_age
   bisect_batch_on_function_error = true
 
+  # Enable partial batch failure support (handler reports the first failed
+  # SequenceNumber so records before it are not republished to Kafka)
+  function_response_types = ["ReportBatchItemFailures"]
+
   # Destination for failed records (optional)
   dynamic "destination_config" {
     for_each = var.enable_dlq ? [1] : []
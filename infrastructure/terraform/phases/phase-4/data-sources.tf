@@ -107,6 +107,15 @@ locals {
     "--ENABLE_KAFKA"            = tostring(local.kafka_enabled)
     "--KAFKA_BOOTSTRAP_SERVERS" = var.msk_bootstrap_brokers
     "--KAFKA_TOPIC"             = var.kafka_consolidation_topic
+    "--PERSIST_STAGES"          = tostring(var.glue_persist_stages)
+    "--PERSIST_STORAGE_LEVEL"   = var.glue_persist_storage_level
+    "--VERIFY_MODE"             = var.glue_verify_mode
+    "--CONSOLIDATION_MODE"      = var.glue_consolidation_mode
+    "--DEDUP_STRATEGY"          = var.glue_dedup_strategy
+    "--extra-py-files"          = "s3://${var.parquet_bucket_name}/${local.glue_dedup_module_s3_key}"
+    
+    # Incremental mode reads only the files added since the last run
+    "--job-bookmark-option" = var.glue_consolidation_mode == "incremental" ? "job-bookmark-enable" : "job-bookmark-disable"
   }
   
   # Merge custom arguments
@@ -124,6 +133,10 @@ locals {
 locals {
   glue_script_local_path = "${path.module}/../../../../deployments/glue-jobs/consolidate_chargebacks.py"
   glue_script_s3_key     = "${var.s3_glue_scripts_prefix}/consolidate_chargebacks.py"
+  
+  # Python modules imported by the script (passed with --extra-py-files)
+  glue_dedup_module_local_path = "${path.module}/../../../../deployments/glue-jobs/dedup.py"
+  glue_dedup_module_s3_key     = "${var.s3_glue_scripts_prefix}/dedup.py"
 }
 
 # -----------------------------------------------------------------------------
@@ -31,6 +31,20 @@ resource "aws_s3_object" "glue_script" {
   }
 }
 
+resource "aws_s3_object" "glue_dedup_module" {
+  bucket = var.parquet_bucket_name
+  key    = local.glue_dedup_module_s3_key
+  source = local.glue_dedup_module_local_path
+  etag   = filemd5(local.glue_dedup_module_local_path)
+  
+  tags = merge(
+    local.common_tags,
+    {
+      Name = "Glue ETL Module - Deduplication"
+    }
+  )
+}
+
 # -----------------------------------------------------------------------------
 # AWS Glue Job - Data Consolidation
 # -----------------------------------------------------------------------------
@@ -81,6 +95,7 @@ resource "aws_glue_job" "consolidation" {
   # Ensure script is uploaded and IAM role exists
   depends_on = [
     aws_s3_object.glue_script,
+    aws_s3_object.glue_dedup_module,
     aws_iam_role_policy_attachment.glue_service_policy,
     aws_iam_role_policy.glue_s3_access,
     aws_iam_role_policy.glue_catalog_access
@@ -54,9 +54,16 @@ resource "aws_lambda_function" "consolidation_updater" {
   # Environment variables
   environment {
     variables = {
-      DYNAMODB_TABLE_NAME = var.dynamodb_table_name
-      AWS_REGION          = local.region
-      LOG_LEVEL           = var.consolidation_updater_log_level
+      DYNAMODB_TABLE_NAME     = var.dynamodb_table_name
+      AWS_REGION              = local.region
+      LOG_LEVEL               = var.consolidation_updater_log_level
+      PARTITION_LOOKUP_MODE   = var.consolidation_partition_lookup_mode
+      CREATED_DATE_INDEX_NAME = var.created_date_index_name
+      CREATED_DATE_SHARDS     = tostring(var.created_date_shards)
+      UPDATE_MAX_CONCURRENCY  = tostring(var.consolidation_update_max_concurrency)
+      UPDATE_RATE_LIMIT       = tostring(var.consolidation_update_rate_limit)
+      CHECKPOINT_TABLE_NAME   = var.enable_consolidation_checkpoints ? aws_dynamodb_table.consolidation_checkpoints[0].name : ""
+      FANOUT_MODE             = var.consolidation_fanout_mode
     }
   }
   
@@ -160,6 +167,53 @@ data "aws_iam_policy_document" "consolidation_updater_dynamodb" {
   }
 }
 
+# -----------------------------------------------------------------------------
+# IAM Policy - Checkpoint Table and Work Unit Fan-out
+# -----------------------------------------------------------------------------
+
+resource "aws_iam_role_policy" "consolidation_updater_checkpoints" {
+  count = var.enable_consolidation_checkpoints ? 1 : 0
+  
+  name   = "${local.name_prefix}-consolidation-updater-checkpoints"
+  role   = aws_iam_role.consolidation_updater.id
+  policy = data.aws_iam_policy_document.consolidation_updater_checkpoints[0].json
+}
+
+data "aws_iam_policy_document" "consolidation_updater_checkpoints" {
+  count = var.enable_consolidation_checkpoints ? 1 : 0
+  
+  statement {
+    sid    = "CheckpointAccess"
+    effect = "Allow"
+    
+    actions = [
+      "dynamodb:GetItem",
+      "dynamodb:UpdateItem"
+    ]
+    
+    resources = [
+      aws_dynamodb_table.consolidation_checkpoints[0].arn
+    ]
+  }
+  
+  dynamic "statement" {
+    for_each = var.consolidation_fanout_mode == "async" ? [1] : []
+    
+    content {
+      sid    = "InvokeSelfForWorkUnits"
+      effect = "Allow"
+      
+      actions = [
+        "lambda:InvokeFunction"
+      ]
+      
+      resources = [
+        "arn:aws:lambda:${local.region}:${local.account_id}:function:${local.name_prefix}-consolidation-updater"
+      ]
+    }
+  }
+}
+
 # -----------------------------------------------------------------------------
 # IAM Policy - MSK Access
 # -----------------------------------------------------------------------------
@@ -406,6 +460,37 @@ resource "aws_sqs_queue" "consolidation_dlq" {
   )
 }
 
+# -----------------------------------------------------------------------------
+# Checkpoint Table (Optional)
+# -----------------------------------------------------------------------------
+# One item per consolidation event, listing the work units already applied
+# so a retried Kafka message resumes instead of starting over.
+
+resource "aws_dynamodb_table" "consolidation_checkpoints" {
+  count = var.enable_consolidation_checkpoints ? 1 : 0
+  
+  name         = "${local.name_prefix}-consolidation-checkpoints"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "checkpoint_id"
+  
+  attribute {
+    name = "checkpoint_id"
+    type = "S"
+  }
+  
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+  
+  tags = merge(
+    local.common_tags,
+    {
+      Name = "${local.name_prefix}-consolidation-checkpoints"
+    }
+  )
+}
+
 # -----------------------------------------------------------------------------
 # CloudWatch Alarms
 # -----------------------------------------------------------------------------
@@ -193,6 +193,58 @@ variable "parquet_compression_codec" {
   # snappy = best balance of speed and compression for analytics
 }
 
+variable "glue_persist_stages" {
+  description = "Persist the landing data and the deduplicated data in the Glue job instead of recomputing them for every action"
+  type        = bool
+  default     = true
+}
+
+variable "glue_persist_storage_level" {
+  description = "Spark storage level used when glue_persist_stages = true"
+  type        = string
+  default     = "MEMORY_AND_DISK"
+  # MEMORY_AND_DISK (serialized in memory) spills to local disk instead of recomputing when executors run short of memory
+  # MEMORY_AND_DISK_DESER (what DataFrame.cache() uses) is faster to read but larger on G.1X workers
+  
+  validation {
+    condition     = contains(["MEMORY_ONLY", "MEMORY_ONLY_2", "MEMORY_AND_DISK", "MEMORY_AND_DISK_2", "MEMORY_AND_DISK_DESER", "DISK_ONLY", "DISK_ONLY_2", "OFF_HEAP"], var.glue_persist_storage_level)
+    error_message = "glue_persist_storage_level must be a Spark StorageLevel name"
+  }
+}
+
+variable "glue_verify_mode" {
+  description = "How the Glue job verifies its output: metrics (write-time counts + _manifest.json), deep (also re-reads the output) or none"
+  type        = string
+  default     = "metrics"
+  
+  validation {
+    condition     = contains(["metrics", "deep", "none"], var.glue_verify_mode)
+    error_message = "glue_verify_mode must be metrics, deep, or none"
+  }
+}
+
+variable "glue_consolidation_mode" {
+  description = "full (re-read the whole landing partition every run) or incremental (read only new landing files via job bookmarks and merge them into the day's consolidated output)"
+  type        = string
+  default     = "full"
+  
+  validation {
+    condition     = contains(["full", "incremental"], var.glue_consolidation_mode)
+    error_message = "glue_consolidation_mode must be full or incremental"
+  }
+}
+
+variable "glue_dedup_strategy" {
+  description = "How the Glue job keeps the latest row per chargeback: max_struct (max of a struct per chargeback) or window (row_number)"
+  type        = string
+  default     = "max_struct"
+  
+  validation {
+    condition     = contains(["max_struct", "window"], var.glue_dedup_strategy)
+    error_message = "glue_dedup_strategy must be max_struct or window"
+  }
+}
+
 # -----------------------------------------------------------------------------
 # S3 Path Configuration
 # -----------------------------------------------------------------------------
@@ -383,6 +435,63 @@ variable "dynamodb_table_name" {
   # Example: "poc-chargeback-chargebacks-dev"
 }
 
+variable "consolidation_partition_lookup_mode" {
+  description = "How the consolidation updater finds a day's chargebacks: query (created-date GSI) or scan"
+  type        = string
+  default     = "scan"
+  # query requires every item to carry created_date_bucket (see Phase 1
+  # dynamodb.tf): switch only once the writer sets it and a backfill has run
+  
+  validation {
+    condition     = contains(["query", "scan"], var.consolidation_partition_lookup_mode)
+    error_message = "Partition lookup mode must be query or scan."
+  }
+}
+
+variable "created_date_index_name" {
+  description = "Name of the created-date GSI on the chargebacks table (from Phase 1)"
+  type        = string
+  default     = "created-date-index"
+}
+
+variable "created_date_shards" {
+  description = "Number of shards per day in created_date_bucket (must match the writer)"
+  type        = number
+  default     = 16
+  # 5M chargebacks/day ÷ 16 shards ≈ 310K items per index partition key
+}
+
+variable "consolidation_update_max_concurrency" {
+  description = "Maximum concurrent UpdateItem calls per consolidation updater invocation"
+  type        = number
+  default     = 32
+}
+
+variable "consolidation_update_rate_limit" {
+  description = "Maximum UpdateItem calls per second per invocation (0 = unlimited, adaptive concurrency only)"
+  type        = number
+  default     = 0
+}
+
+variable "enable_consolidation_checkpoints" {
+  description = "Split consolidation updates into checkpointed work units that resume on retry"
+  type        = bool
+  default     = true
+  # Creates the <prefix>-consolidation-checkpoints DynamoDB table
+}
+
+variable "consolidation_fanout_mode" {
+  description = "How checkpointed work units run: none (in the receiving invocation) or async (one invocation per unit)"
+  type        = string
+  default     = "none"
+  # async requires enable_consolidation_checkpoints
+  
+  validation {
+    condition     = contains(["none", "async"], var.consolidation_fanout_mode)
+    error_message = "Fan-out mode must be none or async."
+  }
+}
+
 # -----------------------------------------------------------------------------
 # CloudWatch Monitoring Configuration
 # -----------------------------------------------------------------------------